@@ -1,69 +1,125 @@
+import os
 import json
+import time
 import logging
-import os
-from database.db import new_session
-from database.models import  Event
-from sqlalchemy import select
-from fastapi import HTTPException
-from openai import OpenAI
-
-async def expect_ai(city: str):
-    async with new_session() as sess:
-        q = select(Event).where(Event.city == city).order_by(Event.event_time.desc()).limit(5)
-        res = await sess.execute(q)
-        events = res.scalars().all()
-
-    if events:
-        events_text = "\n".join(
-            [
-                f"- {e.name} | {e.place} | {e.event_time.isoformat()} | type: {getattr(e, 'event_type', None)} | link: {getattr(e, 'message_link', None)}"
-                for e in events
-            ]
-        )
-    else:
-        events_text = "Нет известных событий для этого города."
-
-    if len(events) == 1 and not isinstance(events, str):
-        return events
-
-    if not os.getenv("OPENAI_API_KEY") and isinstance(events, str):
-        return events[0]
-
-    if not os.getenv("OPENAI_API_KEY") or isinstance(events, str):
-        return HTTPException(status_code=400, detail="OpenAI API key is required")
-
-    client = OpenAI()
+
+from cache import cached
+from crud import get_upcoming_city_events
+from exceptions import NoUrlFoundException, RecommendationUnavailable
+
+logger = logging.getLogger(__name__)
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "20"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "1"))
+# Рекомендация для города меняется редко, а запрос к модели дорогой
+EXPECT_CACHE_TTL_SECONDS = float(os.getenv("EXPECT_CACHE_TTL_SECONDS", "600"))
+EXPECT_CANDIDATES = int(os.getenv("EXPECT_CANDIDATES", "10"))
+# Запасной рейтинг кэшируется ненадолго: после восстановления модели город
+# быстро получит её рекомендацию
+EXPECT_FALLBACK_CACHE_TTL_SECONDS = float(os.getenv("EXPECT_FALLBACK_CACHE_TTL_SECONDS", "30"))
+# Сколько секунд после ошибки модели не обращаться к ней вовсе
+EXPECT_AI_COOLDOWN_SECONDS = float(os.getenv("EXPECT_AI_COOLDOWN_SECONDS", "60"))
+
+_client = None
+_model_down_until = 0.0
+
+
+def _get_client():
+    # SDK openai тяжёлый (~0.6 с на импорт), грузим только при первом вызове.
+    # Адрес берётся из OPENAI_BASE_URL, так что локально можно подставить заглушку
+    global _client
+    if _client is None:
+        from openai import AsyncOpenAI
+
+        _client = AsyncOpenAI(timeout=OPENAI_TIMEOUT_SECONDS, max_retries=OPENAI_MAX_RETRIES)
+    return _client
+
+
+async def close_ai_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+def rank_events(events: list[dict]) -> list[dict]:
+    """Детерминированный рейтинг без модели: сначала события со свободными
+    местами, среди них — самые заполненные, затем ближайшие по времени."""
+
+    def key(event: dict):
+        seats_total = event["seats_total"] or 0
+        sold_out = event["purchased_count"] >= seats_total
+        fill = event["purchased_count"] / seats_total if seats_total else 0.0
+        return sold_out, -fill, event["event_time"], event["event_id"]
+
+    return sorted(events, key=key)
+
+
+def _parse_json_object(text: str) -> dict:
+    try:
+        return json.loads(text)
+    except ValueError:
+        start = text.find("{")
+        end = text.rfind("}")
+        if start == -1 or end <= start:
+            raise
+        return json.loads(text[start:end + 1])
+
+
+async def _ask_model(city: str, events: list[dict]) -> dict:
+    events_text = "\n".join(
+        f"- event_id={e['event_id']} | {e['name']} | {e['place']} | {e['event_time'].isoformat()} | "
+        f"type: {e['event_type']} | price: {e['price']} | seats left: {e['seats_total'] - e['purchased_count']}"
+        for e in events
+    )
     instruction = (
-        f"Верни один json события, которое ты считаешь более подходящим по актуальности для текущего сезона в городе {city}. "
-        "Возвращай только JSON-объект, без пояснений. Поля: long_url, name, place, city, event_time (ISO), price, description, event_type, message_link, purchased_count, seats_total, account_id."
-        f"\n\nСуществующие события (ограничено 5):\n{events_text}"
+        f"Выбери одно событие, которое ты считаешь наиболее подходящим по актуальности для текущего сезона в городе {city}. "
+        'Верни только JSON-объект вида {"event_id": <число>}, без пояснений.'
+        f"\n\nСобытия:\n{events_text}"
     )
+    by_id = {event["event_id"]: event for event in events}
+    try:
+        response = await _get_client().responses.create(model=OPENAI_MODEL, input=instruction)
+        event_id = _parse_json_object(response.output_text).get("event_id")
+    except Exception as exc:
+        raise RecommendationUnavailable(str(exc)) from exc
+    if event_id not in by_id:
+        raise RecommendationUnavailable(f"Model picked unknown event_id {event_id!r}")
+    return {**by_id[event_id], "source": "ai"}
+
+
+@cached("expect", ttl=EXPECT_CACHE_TTL_SECONDS)
+async def _recommend(city: str) -> dict:
+    # Одновременные запросы по одному городу ждут одну загрузку (single-flight
+    # в cache.get_or_load). Исключения не кэшируются: ни ошибка модели, ни
+    # NoUrlFoundException для города, где событий пока нет
+    events = await get_upcoming_city_events(city, EXPECT_CANDIDATES)
+    if not events:
+        raise NoUrlFoundException
+    if len(events) == 1 or not os.getenv("OPENAI_API_KEY"):
+        return {**rank_events(events)[0], "source": "fallback"}
+    return await _ask_model(city, events)
+
+
+@cached("expect_fallback", ttl=EXPECT_FALLBACK_CACHE_TTL_SECONDS)
+async def _fallback(city: str) -> dict:
+    events = await get_upcoming_city_events(city, EXPECT_CANDIDATES)
+    if not events:
+        raise NoUrlFoundException
+    return {**rank_events(events)[0], "source": "fallback"}
+
+
+async def expect_ai(city: str) -> dict:
+    global _model_down_until
+    # Пока модель недавно отказала, сразу отдаём запасной рейтинг, а не ждём
+    # OPENAI_TIMEOUT_SECONDS на каждом промахе кэша
+    if time.monotonic() < _model_down_until:
+        return await _fallback(city)
     try:
-        resp = client.responses.create(model="gpt-4o-mini", input=instruction)
-        text = None
-        try:
-            text = resp.output[0].content[0].text
-        except Exception:
-            try:
-                text = resp.output_text
-            except Exception:
-                text = str(resp)
-        try:
-            parsed = json.loads(text)
-            return parsed
-        except Exception:
-            start = text.find('{')
-            end = text.rfind('}')
-            if start != -1 and end != -1 and end > start:
-                snippet = text[start:end+1]
-                try:
-                    parsed = json.loads(snippet)
-                    return parsed
-                except Exception:
-                    pass
-        raise HTTPException(status_code=500, detail="Failed to parse AI response as JSON")
-    except HTTPException:
-        raise
-    except Exception as e:
-        logging.exception("AI request failed")
-        raise HTTPException(status_code=500, detail=f"AI request failed: {e}")
+        return await _recommend(city)
+    except RecommendationUnavailable as exc:
+        # Ошибку получают все ожидавшие single-flight загрузку, без трейсбека в каждом
+        logger.warning("AI recommendation failed for %s, using fallback ranking: %s", city, exc)
+        _model_down_until = time.monotonic() + EXPECT_AI_COOLDOWN_SECONDS
+        return await _fallback(city)
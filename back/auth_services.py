@@ -1,4 +1,10 @@
 import os
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import importlib.util
 from typing import Any, Dict
 from pathlib import Path
 
@@ -11,6 +17,7 @@ import random
 from mail_services import send_registration_email, send_password_reset_notice
 
 from crud import create_user_in_db
+from cache import cache, make_key
 load_dotenv('.env')
 
 def require_api_key(x_api_key: str = Header(..., alias="X-API-KEY")):
@@ -24,6 +31,76 @@ FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
 
 IDENTITY_BASE_URL = "https://identitytoolkit.googleapis.com/v1"
 
+# Верхняя граница жизни записи в кэше токенов: отозванный или
+# заблокированный аккаунт перестанет проходить не позже чем через это время
+TOKEN_CACHE_MAX_TTL = float(os.getenv("TOKEN_CACHE_MAX_TTL_SECONDS", "300"))
+
+
+FIREBASE_HTTP_POOL_SIZE = int(os.getenv("FIREBASE_HTTP_POOL_SIZE", "20"))
+FIREBASE_HTTP_TIMEOUT = float(os.getenv("FIREBASE_HTTP_TIMEOUT_SECONDS", "10"))
+FIREBASE_HTTP_RETRIES = int(os.getenv("FIREBASE_HTTP_RETRIES", "2"))
+FIREBASE_HTTP_BACKOFF = float(os.getenv("FIREBASE_HTTP_BACKOFF_SECONDS", "0.2"))
+RETRY_STATUSES = {500, 502, 503, 504}
+# Повтор после 5xx или обрыва ответа безопасен только для чтения и входа:
+# signUp, sendOobCode и resetPassword могли уже выполниться на стороне Firebase
+IDEMPOTENT_PATHS = {"accounts:lookup", "accounts:signInWithPassword"}
+# Ошибки, при которых запрос точно не ушёл на сервер: их повторяем всегда
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_http_client: httpx.AsyncClient | None = None
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    # HTTP/2 требует пакет h2 (httpx[http2]); без него остаёмся на HTTP/1.1
+    http2 = os.getenv("FIREBASE_HTTP2", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+    return httpx.AsyncClient(
+        base_url=IDENTITY_BASE_URL,
+        http2=http2,
+        timeout=FIREBASE_HTTP_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=FIREBASE_HTTP_POOL_SIZE,
+            max_keepalive_connections=FIREBASE_HTTP_POOL_SIZE,
+            keepalive_expiry=60,
+        ),
+    )
+
+
+async def start_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = _build_http_client()
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    # Вне lifespan (скрипты, консоль) клиент создаётся при первом запросе
+    global _http_client
+    if _http_client is None:
+        _http_client = _build_http_client()
+    return _http_client
+
+
+async def _post_with_retries(path: str, payload: Dict[str, Any]) -> httpx.Response:
+    client = _get_http_client()
+    idempotent = path in IDEMPOTENT_PATHS
+    retryable = httpx.TransportError if idempotent else NOT_SENT_ERRORS
+    for attempt in range(FIREBASE_HTTP_RETRIES + 1):
+        try:
+            resp = await client.post(f"/{path}", params={"key": FIREBASE_API_KEY}, json=payload)
+            if not idempotent or resp.status_code not in RETRY_STATUSES or attempt == FIREBASE_HTTP_RETRIES:
+                return resp
+        except retryable:
+            if attempt == FIREBASE_HTTP_RETRIES:
+                raise
+        # Full jitter: воркеры не бьют в Firebase синхронными волнами
+        await asyncio.sleep(random.uniform(0, FIREBASE_HTTP_BACKOFF * 2 ** attempt))
+
 
 async def _request(path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
     if not FIREBASE_API_KEY:
@@ -32,15 +109,19 @@ async def _request(path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
             detail="FIREBASE_API_KEY is not configured",
         )
 
-    url = f"{IDENTITY_BASE_URL}/{path}?key={FIREBASE_API_KEY}"
-    async with httpx.AsyncClient(timeout=10) as client:
-        resp = await client.post(url, json=payload)
-        if resp.status_code >= 400:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=resp.json().get("error", {}).get("message", "Firebase auth error"),
-            )
-        return resp.json()
+    try:
+        resp = await _post_with_retries(path, payload)
+    except httpx.TransportError:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Firebase auth is unavailable",
+        )
+    if resp.status_code >= 400:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=resp.json().get("error", {}).get("message", "Firebase auth error"),
+        )
+    return resp.json()
 
 
 async def register_user(email: str, password: str) -> Dict[str, Any]:
@@ -132,10 +213,23 @@ async def confirm_password_reset(oob_code: str, new_password: str) -> Dict[str,
     )
 
 
-async def verify_id_token(id_token: str) -> Dict[str, Any]:
-    """Верифицирует Firebase ID токен и возвращает данные пользователя"""
+def _token_expires_at(id_token: str) -> float | None:
+    """Читает exp из payload JWT без проверки подписи.
+
+    Подпись проверяет Firebase при первом lookup; здесь exp нужен только
+    чтобы не держать результат в кэше дольше жизни самого токена.
+    """
     try:
-        return await _request(
+        payload = id_token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except Exception:
+        return None
+
+
+async def _lookup_id_token(id_token: str) -> Dict[str, Any]:
+    try:
+        data = await _request(
             "accounts:lookup",
             {
                 "idToken": id_token,
@@ -146,3 +240,25 @@ async def verify_id_token(id_token: str) -> Dict[str, Any]:
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or expired token",
         )
+    # В кэш (в том числе общий) кладём только то, что нужно для авторизации
+    return {
+        "users": [
+            {
+                "localId": user.get("localId"),
+                "email": user.get("email"),
+                "emailVerified": user.get("emailVerified"),
+            }
+            for user in data.get("users", [])
+        ]
+    }
+
+
+async def verify_id_token(id_token: str) -> Dict[str, Any]:
+    """Верифицирует Firebase ID токен и возвращает данные пользователя"""
+    expires_at = _token_expires_at(id_token)
+    ttl = min(expires_at - time.time(), TOKEN_CACHE_MAX_TTL) if expires_at else 0
+    if ttl <= 0:
+        return await _lookup_id_token(id_token)
+    # Ключ — хэш токена, сам токен нигде не хранится
+    key = make_key("token", hashlib.sha256(id_token.encode()).hexdigest())
+    return await cache.get_or_load(key, lambda: _lookup_id_token(id_token), ttl=ttl)
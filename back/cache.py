@@ -0,0 +1,376 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import inspect
+import logging
+import functools
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "impulse:cache:invalidate"
+
+
+class _LoadAbandoned(Exception):
+    """Ведущий загрузку отменён, ожидающие должны повторить попытку."""
+
+
+class MemoryBackend:
+    """Ограниченный LRU с TTL на ключ внутри одного процесса.
+
+    Все операции синхронные, поэтому внутри одного event loop хранилище
+    безопасно без блокировок.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def set(self, key: str, value: Any, ttl: float):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def delete_namespace(self, namespace: str):
+        prefix = f"{namespace}:"
+        for key in [k for k in self._data if k.startswith(prefix)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _json_default(value):
+    # В кэше лежат dict/list из базы: даты и Decimal кодируем с меткой типа
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"__decimal__": str(value)}
+    raise TypeError(f"Cannot cache value of type {type(value).__name__}")
+
+
+def _json_object_hook(obj: dict):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+        if "__decimal__" in obj:
+            return Decimal(obj["__decimal__"])
+    return obj
+
+
+class RedisBackend:
+    """Общий для всех воркеров кэш поверх Redis-протокола.
+
+    Принимает любой клиент с API redis.asyncio, в том числе
+    fakeredis.aioredis.FakeRedis для локальных тестов.
+
+    Значения хранятся в JSON, не в pickle: распаковка pickle из общего
+    Redis выполнила бы любой код, который туда положили. Пространство имён
+    сбрасывается сменой поколения в ключе (INCR), а не удалением ключей:
+    старые записи просто перестают читаться и истекают по своему TTL.
+    """
+
+    name = "redis"
+    prefix = "impulse:cache:"
+
+    def __init__(self, client):
+        self.client = client
+        # Текущее поколение пространства имён: читается из Redis один раз,
+        # дальше обновляется своими INCR и сообщениями других воркеров
+        self.generations: dict[str, int] = {}
+
+    async def _generation(self, namespace: str) -> int:
+        generation = self.generations.get(namespace)
+        if generation is None:
+            raw = await self.client.get(f"{self.prefix}gen:{namespace}")
+            generation = self.generations[namespace] = int(raw or 0)
+        return generation
+
+    def observe_generation(self, namespace: str, generation: int):
+        self.generations[namespace] = max(self.generations.get(namespace, 0), generation)
+
+    async def _key(self, key: str) -> str:
+        namespace, rest = key.split(":", 1)
+        return f"{self.prefix}{namespace}:{await self._generation(namespace)}:{rest}"
+
+    async def get(self, key: str) -> tuple[bool, Any]:
+        raw = await self.client.get(await self._key(key))
+        if raw is None:
+            return False, None
+        return True, json.loads(raw, object_hook=_json_object_hook)
+
+    async def set(self, key: str, value: Any, ttl: float):
+        raw = json.dumps(value, default=_json_default, ensure_ascii=False)
+        await self.client.set(await self._key(key), raw, px=max(int(ttl * 1000), 1))
+
+    async def delete(self, key: str):
+        await self.client.delete(await self._key(key))
+
+    async def delete_namespace(self, namespace: str) -> int:
+        generation = await self.client.incr(f"{self.prefix}gen:{namespace}")
+        self.observe_generation(namespace, generation)
+        return generation
+
+    async def publish(self, message: dict):
+        await self.client.publish(INVALIDATION_CHANNEL, json.dumps(message))
+
+
+class Cache:
+    """Кэш с single-flight загрузкой поверх локального и общего хранилищ.
+
+    Локальный LRU отвечает без сетевых походов; если настроен Redis,
+    он служит вторым уровнем, а инвалидации рассылаются через pub/sub,
+    чтобы остальные воркеры сбросили свои локальные копии.
+    """
+
+    def __init__(self, max_entries: int = 10_000, ttl: float = 30.0, local_ttl: float | None = None):
+        self.ttl = ttl
+        self.local_ttl = ttl if local_ttl is None else local_ttl
+        self.local = MemoryBackend(max_entries)
+        self.shared: RedisBackend | None = None
+        self.instance_id = uuid.uuid4().hex
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._subscriber: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+        self.remote_invalidations = 0
+
+    async def connect(self, url: str | None = None, client=None):
+        url = url if url is not None else os.getenv("CACHE_URL", "memory://")
+        if client is None:
+            if not url.startswith(("redis://", "rediss://", "unix://")):
+                return
+            import redis.asyncio as redis
+
+            client = redis.from_url(url)
+        self.shared = RedisBackend(client)
+        self._subscriber = asyncio.create_task(self._listen())
+
+    async def close(self):
+        if self._subscriber is not None:
+            self._subscriber.cancel()
+            try:
+                await self._subscriber
+            except asyncio.CancelledError:
+                pass
+            self._subscriber = None
+        if self.shared is not None:
+            await self.shared.client.aclose()
+            self.shared = None
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = self.shared.client.pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                try:
+                    async for message in pubsub.listen():
+                        if message.get("type") != "message":
+                            continue
+                        self._apply_remote(json.loads(message["data"]))
+                finally:
+                    await pubsub.aclose()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Cache invalidation subscriber failed, reconnecting")
+                # Пока подписки нет, чужие записи и поколения могли устареть
+                self.local.clear()
+                self.shared.generations.clear()
+                await asyncio.sleep(1)
+
+    def _apply_remote(self, message: dict):
+        if message.get("origin") == self.instance_id:
+            return
+        self.remote_invalidations += 1
+        if message.get("generation") is not None and self.shared is not None:
+            self.shared.observe_generation(message["namespace"], message["generation"])
+        self._drop_local(key=message.get("key"), namespace=message.get("namespace"))
+
+    def _drop_local(self, key: str | None = None, namespace: str | None = None):
+        if key is not None:
+            self.local.delete(key)
+            self._inflight.pop(key, None)
+        if namespace is not None:
+            self.local.delete_namespace(namespace)
+            prefix = f"{namespace}:"
+            for k in [k for k in self._inflight if k.startswith(prefix)]:
+                del self._inflight[k]
+
+    async def invalidate(self, key: str | None = None, namespace: str | None = None):
+        self._drop_local(key=key, namespace=namespace)
+        if self.shared is None:
+            return
+        try:
+            generation = None
+            if key is not None:
+                await self.shared.delete(key)
+            if namespace is not None:
+                generation = await self.shared.delete_namespace(namespace)
+            await self.shared.publish(
+                {"origin": self.instance_id, "key": key, "namespace": namespace, "generation": generation}
+            )
+        except Exception:
+            logger.exception("Failed to propagate cache invalidation")
+
+    async def _load_shared(self, key: str) -> tuple[bool, Any]:
+        try:
+            return await self.shared.get(key)
+        except Exception:
+            logger.exception("Shared cache read failed")
+            return False, None
+
+    async def _store(self, key: str, value: Any, ttl: float | None):
+        ttl = self.ttl if ttl is None else ttl
+        self.local.set(key, value, min(ttl, self.local_ttl))
+        if self.shared is None:
+            return
+        try:
+            await self.shared.set(key, value, ttl)
+        except Exception:
+            logger.exception("Shared cache write failed")
+
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: float | None = None,
+    ) -> Any:
+        while True:
+            found, value = self.local.get(key)
+            if found:
+                self.hits += 1
+                return value
+
+            pending = self._inflight.get(key)
+            if pending is None:
+                break
+            self.misses += 1
+            try:
+                return await asyncio.shield(pending)
+            except _LoadAbandoned:
+                # Ведущего отменили вместе с его запросом: пробуем снова,
+                # первый из ожидающих сам станет ведущим
+                continue
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            found = False
+            if self.shared is not None:
+                found, value = await self._load_shared(key)
+            if found:
+                self.hits += 1
+                self.local.set(key, value, min(self.ttl if ttl is None else ttl, self.local_ttl))
+            else:
+                self.misses += 1
+                value = await loader()
+                # Ключ могли инвалидировать, пока шла загрузка: тогда результат
+                # отдаём ожидающим, но в кэш не кладём
+                if self._inflight.get(key) is future:
+                    await self._store(key, value, ttl)
+        except Exception as exc:
+            # Ошибку самой загрузки получают все ожидающие
+            future.set_exception(exc)
+            # Исключение уже проброшено вызывающему; подавляем предупреждение
+            # "exception was never retrieved", если других ожидающих нет
+            future.exception()
+            raise
+        except BaseException:
+            # Отмена касается только ведущего, а не тех, кто ждёт тот же ключ
+            future.set_exception(_LoadAbandoned())
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.shared.name if self.shared is not None else self.local.name,
+            "entries": len(self.local),
+            "max_entries": self.local.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.local.evictions,
+            "remote_invalidations": self.remote_invalidations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+cache = Cache(
+    max_entries=int(os.getenv("CACHE_MAX_ENTRIES", "10000")),
+    ttl=float(os.getenv("CACHE_TTL_SECONDS", "30")),
+    local_ttl=float(os.getenv("CACHE_LOCAL_TTL_SECONDS")) if os.getenv("CACHE_LOCAL_TTL_SECONDS") else None,
+)
+
+
+def make_key(namespace: str, *parts) -> str:
+    return namespace + ":" + ":".join(repr(part) for part in parts)
+
+
+async def invalidate(namespace: str, *parts):
+    """Сбрасывает один ключ, а без parts — всё пространство имён, во всех воркерах."""
+    if parts:
+        await cache.invalidate(key=make_key(namespace, *parts))
+    else:
+        await cache.invalidate(namespace=namespace)
+
+
+def cached(namespace: str, ttl: float | None = None):
+    """Кэширует результат корутины по её аргументам.
+
+    Ключ строится из всех аргументов сигнатуры (включая значения по умолчанию),
+    так что f(1) и f(event_id=1) попадают в одну запись и одинаково
+    сбрасываются через invalidate(namespace, 1).
+    """
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = make_key(namespace, *bound.arguments.values())
+            return await cache.get_or_load(key, lambda: func(*args, **kwargs), ttl)
+
+        wrapper.uncached = func
+        return wrapper
+
+    return decorator
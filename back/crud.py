@@ -1,11 +1,29 @@
-from datetime import datetime, timezone
+import re
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator
 
-from database.db import new_session
-from database.models import Order, Event, User
-from sqlalchemy import select
+from cache import cached, invalidate
+from database.db import engine, new_session, new_read_session
+from database.models import (
+    Order,
+    Event,
+    EventSeatShard,
+    User,
+    EmailOutbox,
+    IdempotencyKey,
+    EventSales,
+    EventSalesByPayment,
+    EventSalesByDay,
+    CitySales,
+    EVENT_SEARCH_DOCUMENT,
+)
+from sqlalchemy import ARRAY, Integer, String, and_, any_, delete, false, insert, literal, select, func, literal_column, or_, tuple_, update
 from sqlalchemy.exc import IntegrityError
-from exceptions import SlugAlreadyExists
+from exceptions import SlugAlreadyExists, SeatsUnavailable
 from sqlalchemy.exc import IntegrityError as SAIntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 
 
@@ -53,14 +71,66 @@ async def add_slug_to_db(
         try: 
             await session.commit()
             await session.refresh(new_slug)
-            return new_slug.event_id
         except IntegrityError:
             raise SlugAlreadyExists
+        await invalidate("events_between")
+        await _invalidate_expect(city)
+        return new_slug.event_id
 
         
 
-async def get_url_from_db(slug: str) -> str | None:
+BULK_EVENT_COLUMNS = (
+    "slug",
+    "long_url",
+    "name",
+    "place",
+    "city",
+    "event_time",
+    "event_end_time",
+    "status",
+    "price",
+    "description",
+    "event_type",
+    "message_link",
+    "purchased_count",
+    "seats_total",
+    "account_id",
+)
+
+
+async def get_existing_slugs(slugs: list[str]) -> set[str]:
     async with new_session() as session:
+        result = await session.execute(
+            select(Event.slug).where(Event.slug == any_(literal(slugs, ARRAY(String))))
+        )
+        return {row[0] for row in result.all()}
+
+
+async def copy_events_to_db(records: list[tuple]) -> int:
+    """Загружает события одной командой COPY; порядок полей — BULK_EVENT_COLUMNS.
+
+    При конфликте slug COPY откатывается целиком и бросает SlugAlreadyExists.
+    """
+    async with engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        try:
+            await raw.driver_connection.copy_records_to_table(
+                Event.__tablename__,
+                records=records,
+                columns=BULK_EVENT_COLUMNS,
+            )
+        except Exception as exc:
+            if getattr(exc, "sqlstate", None) == "23505":
+                raise SlugAlreadyExists
+            raise
+    await invalidate("events_between")
+    city_index = BULK_EVENT_COLUMNS.index("city")
+    await _invalidate_expect(*(record[city_index] for record in records))
+    return len(records)
+
+
+async def get_url_from_db(slug: str) -> str | None:
+    async with new_read_session() as session:
         query = select(Event).filter_by(slug=slug)
         result = await session.execute(query)
         res: Event | None = result.scalar_one_or_none()
@@ -69,38 +139,134 @@ async def get_url_from_db(slug: str) -> str | None:
     return res.long_url
 
 
+async def _invalidate_event(event_id: int, listings: bool = True):
+    await invalidate("event", event_id)
+    await invalidate("event_model", event_id)
+    # Листинги тоже показывают purchased_count, но после заказа им хватает
+    # своего TTL: сброс всего пространства на каждом заказе обнулял бы кэш
+    # листингов во всех воркерах
+    if listings:
+        await invalidate("events_between")
+
+
+async def _invalidate_expect(*cities: str):
+    # Рекомендация /expect кэшируется по городу (ai_service._recommend)
+    for city in dict.fromkeys(cities):
+        await invalidate("expect", city)
+        await invalidate("expect_fallback", city)
+
+
+# Колонки события по имени поля в ответе API
+EVENT_FIELDS = {column.key: column for column in Event.__table__.columns if column.key != "sharded"}
+# Карточка в списке: без длинного описания и служебного account_id
+EVENT_CARD_FIELDS = tuple(name for name in EVENT_FIELDS if name not in ("description", "account_id"))
+
+
+def _event_columns(fields: tuple[str, ...] | None, *required: str) -> list:
+    if fields is None:
+        return list(EVENT_FIELDS.values())
+    names = dict.fromkeys(("event_id", *required, *fields))
+    return [EVENT_FIELDS[name] for name in names]
+
+
+def _event_row(row) -> dict:
+    # Core-строка сразу в dict: без identity map и ручного копирования полей
+    event = dict(row._mapping)
+    if event.get("price") is not None:
+        event["price"] = float(event["price"])
+    return event
+
+
+@cached("event")
 async def get_event_from_db(event_id: int) -> dict | None:
+    # Загрузчики под @cached читают с primary: см. new_read_session
     async with new_session() as session:
-        query = select(Event).filter_by(event_id=event_id)
-        result = await session.execute(query)
-        res: Event | None = result.scalar_one_or_none()
-        if not res:
+        query = select(*EVENT_FIELDS.values()).where(Event.event_id == event_id)
+        row = (await session.execute(query)).one_or_none()
+        if row is None:
             return None
-        return {
-            "event_id": res.event_id,
-            "slug": res.slug,
-            "long_url": res.long_url,
-            "name": res.name,
-            "place": res.place,
-            "city": res.city,
-            "event_time": res.event_time,
-            "event_end_time": res.event_end_time,
-            "status": res.status,
-            "price": float(res.price),
-            "description": res.description,
-            "event_type": res.event_type,
-            "message_link": res.message_link,
-            "purchased_count": res.purchased_count,
-            "seats_total": res.seats_total,
-            "account_id": res.account_id,
-        }
+    event = _event_row(row)
+    if await get_seat_shard_count(event_id):
+        event["purchased_count"] = await get_sharded_purchased_count(event_id)
+    return event
+
 
+async def get_events_by_ids(event_ids: list[int], fields: tuple[str, ...] | None = None) -> list[dict]:
+    async with new_read_session() as session:
+        # Один параметр-массив вместо IN (...) на N плейсхолдеров
+        query = select(*_event_columns(fields)).where(Event.event_id == any_(literal(event_ids, ARRAY(Integer))))
+        result = await session.execute(query)
+        return [_event_row(row) for row in result]
 
+
+async def get_upcoming_city_events(city: str, limit: int) -> list[dict]:
+    # Ближайшие события города: идёт по индексу (city, event_time, event_id)
+    async with new_session() as session:
+        query = (
+            select(*EVENT_FIELDS.values())
+            .where(Event.city == city, Event.event_time >= datetime.utcnow())
+            .order_by(Event.event_time.asc(), Event.event_id.asc())
+            .limit(limit)
+        )
+        result = await session.execute(query)
+        return [_event_row(row) for row in result]
+
+
+async def load_recommender_snapshot(since: datetime) -> tuple[list[dict], list[tuple], int]:
+    """Предстоящие события, число заказов по (email, город, тип) и последний
+    id заказа — из одного снимка, чтобы заказы не посчитались дважды."""
+    async with new_read_session() as session:
+        await session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        result = await session.execute(
+            select(*_event_columns(EVENT_CARD_FIELDS)).where(Event.event_time >= since)
+        )
+        events = [_event_row(row) for row in result]
+        result = await session.execute(
+            select(func.lower(Order.email), Event.city, Event.event_type, func.count())
+            .join(Event, Event.event_id == Order.event_id)
+            .group_by(func.lower(Order.email), Event.city, Event.event_type)
+        )
+        affinity = [tuple(row) for row in result]
+        last_order_id = (await session.execute(select(func.coalesce(func.max(Order.id), 0)))).scalar_one()
+    return events, affinity, last_order_id
+
+
+async def get_orders_after(order_id: int, limit: int) -> list[tuple]:
+    async with new_read_session() as session:
+        result = await session.execute(
+            select(Order.id, Order.event_id, func.lower(Order.email), Order.people_count, Event.city, Event.event_type)
+            .join(Event, Event.event_id == Order.event_id)
+            .where(Order.id > order_id)
+            .order_by(Order.id)
+            .limit(limit)
+        )
+        return [tuple(row) for row in result]
+
+
+async def get_upcoming_events_after(event_id: int, since: datetime) -> list[dict]:
+    async with new_read_session() as session:
+        result = await session.execute(
+            select(*_event_columns(EVENT_CARD_FIELDS))
+            .where(Event.event_id > event_id, Event.event_time >= since)
+            .order_by(Event.event_id)
+        )
+        return [_event_row(row) for row in result]
+
+
+@cached("events_between")
 async def get_events_between_dates(
     start: datetime,
     end: datetime,
     limit: int = 100,
-) -> list[Event]:
+    after: tuple[datetime, int] | None = None,
+    city: str | None = None,
+    event_types: list[str] | None = None,
+    status: str | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    account_id: int | None = None,
+    fields: tuple[str, ...] | None = None,
+) -> list[dict]:
     async with new_session() as session:
         
         if start is not None and getattr(start, "tzinfo", None) is not None:
@@ -109,20 +275,194 @@ async def get_events_between_dates(
             end = end.astimezone(timezone.utc).replace(tzinfo=None)
 
         query = (
-            select(Event)
+            select(*_event_columns(fields, "event_time"))
             .where(Event.event_time.between(start, end))
-            .order_by(Event.event_time.asc())
+            .order_by(Event.event_time.asc(), Event.event_id.asc())
             .limit(limit)
         )
+        if after is not None:
+            # Keyset: продолжаем строго после последней выданной пары,
+            # индекс (event_time, event_id) делает любую страницу дешёвой
+            query = query.where(tuple_(Event.event_time, Event.event_id) > tuple_(*after))
+        if city is not None:
+            query = query.where(Event.city == city)
+        if event_types:
+            query = query.where(Event.event_type.in_(event_types))
+        if status is not None:
+            query = query.where(Event.status == status)
+        if min_price is not None:
+            query = query.where(Event.price >= min_price)
+        if max_price is not None:
+            query = query.where(Event.price <= max_price)
+        if account_id is not None:
+            query = query.where(Event.account_id == account_id)
         result = await session.execute(query)
-        return list(result.scalars().all())
+        return [_event_row(row) for row in result]
 
 
-async def get_event_by_id(event_id: int) -> Event | None:
+def _prefix_tsquery(query: str) -> str | None:
+    # "рок конц" -> "рок:* & конц:*": каждое слово ищется как префикс
+    words = re.findall(r"\w+", query.lower())
+    if not words:
+        return None
+    return " & ".join(f"{word}:*" for word in words)
+
+
+async def search_events(
+    query: str,
+    limit: int = 20,
+    offset: int = 0,
+    fields: tuple[str, ...] | None = None,
+) -> list[dict]:
+    tsquery_text = _prefix_tsquery(query)
+    if tsquery_text is None:
+        return []
+    document = literal_column(EVENT_SEARCH_DOCUMENT)
+    tsquery = func.to_tsquery("russian", tsquery_text)
+    rank = (
+        func.ts_rank_cd(document, tsquery)
+        + func.greatest(func.similarity(Event.name, query), func.similarity(Event.place, query))
+    ).label("rank")
+
+    async with new_read_session() as session:
+        stmt = (
+            select(*_event_columns(fields), rank)
+            .where(
+                or_(
+                    document.op("@@")(tsquery),
+                    Event.name.op("%")(query),
+                    Event.place.op("%")(query),
+                )
+            )
+            .order_by(rank.desc(), Event.event_time.asc(), Event.event_id.asc())
+            .limit(limit)
+            .offset(offset)
+        )
+        result = await session.execute(stmt)
+        events = []
+        for row in result:
+            event = _event_row(row)
+            event["rank"] = float(event["rank"])
+            events.append(event)
+        return events
+
+
+def _detached(model, values: dict | None):
+    # В кэше лежат только значения колонок, и каждый вызов получает свой
+    # объект: правка атрибутов в одном запросе не видна остальным
+    return model(**values) if values is not None else None
+
+
+async def _load_row(model, *criteria) -> dict | None:
     async with new_session() as session:
-        query = select(Event).filter_by(event_id=event_id)
-        result = await session.execute(query)
-        return result.scalar_one_or_none()
+        row = (await session.execute(select(*model.__table__.columns).where(*criteria))).one_or_none()
+        return dict(row._mapping) if row is not None else None
+
+
+@cached("event_model")
+async def _get_event_values(event_id: int) -> dict | None:
+    return await _load_row(Event, Event.event_id == event_id)
+
+
+async def get_event_by_id(event_id: int) -> Event | None:
+    return _detached(Event, await _get_event_values(event_id))
+
+
+async def _reserve_event_row(session, event_id: int, people_count: int) -> int | None:
+    # Условный UPDATE берёт блокировку только на строку события и
+    # атомарно проверяет остаток мест
+    reserved = (
+        update(Event)
+        .where(
+            Event.event_id == event_id,
+            Event.sharded.is_(False),
+            Event.purchased_count + people_count <= Event.seats_total,
+        )
+        .values(purchased_count=Event.purchased_count + people_count)
+        .returning(Event.purchased_count)
+        .cte("reserved")
+    )
+    # Тот же запрос читает флаг и остаток из снимка до UPDATE: распроданное
+    # нешардированное событие отклоняется сразу, без транзакций по шардам.
+    # Если по снимку места были, строку поменяли параллельно — проверяем шарды
+    row = (
+        await session.execute(
+            select(
+                select(reserved.c.purchased_count).scalar_subquery(),
+                Event.sharded,
+                Event.purchased_count + people_count <= Event.seats_total,
+            ).where(Event.event_id == event_id)
+        )
+    ).one_or_none()
+    if row is None:
+        return None
+    purchased_count, sharded, fits = row
+    if purchased_count is None and not sharded and not fits:
+        raise SeatsUnavailable
+    return purchased_count
+
+
+async def _reserve_one_shard(session, event_id: int, people_count: int) -> bool:
+    fits = EventSeatShard.sold + people_count <= EventSeatShard.capacity
+
+    def take(shard_no):
+        return (
+            update(EventSeatShard)
+            .where(EventSeatShard.event_id == event_id, EventSeatShard.shard_no == shard_no, fits)
+            .values(sold=EventSeatShard.sold + people_count)
+            .returning(EventSeatShard.shard_no)
+            .execution_options(synchronize_session=False)
+        )
+
+    # Сначала случайный шард с достаточным остатком, который сейчас никто
+    # не держит: выбор и списание — один запрос, занятые шарды пропускаются
+    # без ожидания
+    free_shard = (
+        select(EventSeatShard.shard_no)
+        .where(EventSeatShard.event_id == event_id, fits)
+        .order_by(func.random())
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    if (await session.execute(take(free_shard))).scalar_one_or_none() is not None:
+        return True
+    # Все подходящие шарды заняты: ждём один случайный из них. Попытка
+    # ровно одна — неудачный условный UPDATE всё равно оставляет
+    # блокировку строки, и перебор шардов в одной транзакции ведёт к дедлокам
+    candidates = (
+        await session.execute(select(EventSeatShard.shard_no).where(EventSeatShard.event_id == event_id, fits))
+    ).scalars().all()
+    if not candidates:
+        return False
+    return (await session.execute(take(random.choice(candidates)))).scalar_one_or_none() is not None
+
+
+async def _reserve_across_shards(session, event_id: int, people_count: int) -> bool:
+    # Медленный путь у самой распродажи: ни в одном шарде нет нужного
+    # остатка, хотя в сумме он может быть. Шарды блокируются по порядку
+    # номеров, поэтому такие транзакции не образуют циклов ожидания
+    shards = (
+        await session.execute(
+            select(EventSeatShard)
+            .where(EventSeatShard.event_id == event_id)
+            .order_by(EventSeatShard.shard_no)
+            .with_for_update()
+        )
+    ).scalars().all()
+    if not shards:
+        return False
+    if sum(max(shard.capacity - shard.sold, 0) for shard in shards) < people_count:
+        # Все шарды под нашей блокировкой: мест в событии действительно нет
+        raise SeatsUnavailable
+    needed = people_count
+    for shard in shards:
+        take = min(max(shard.capacity - shard.sold, 0), needed)
+        shard.sold += take
+        needed -= take
+        if not needed:
+            break
+    return True
 
 
 async def create_order_in_db(
@@ -131,36 +471,280 @@ async def create_order_in_db(
     payment_method: str,
     people_count: int,
     email: str,
-) -> int:
+) -> tuple[int, int]:
+    # Кэш числа шардов только выбирает, с какого пути начать: после
+    # set_seat_shards он может устареть, поэтому неудача одного пути ведёт на
+    # другой. Авторитетна проверка внутри транзакции (Event.sharded, строки
+    # шардов): убедившись в распродаже, путь сразу поднимает SeatsUnavailable
+    if await get_seat_shard_count(event_id) > 0:
+        reservations = (_reserve_one_shard, _reserve_across_shards, _reserve_event_row)
+    else:
+        reservations = (_reserve_event_row, _reserve_one_shard, _reserve_across_shards)
+
+    # Каждая попытка — отдельная транзакция: откат снимает все блокировки
+    # неудачной попытки до перехода к следующей
+    for reserve in reservations:
+        async with new_session() as session:
+            reserved = await reserve(session, event_id, people_count)
+            if not reserved:
+                await session.rollback()
+                continue
+            # Заказ вставляется в той же транзакции, что и списание мест
+            order = Order(
+                event_id=event_id,
+                qrcode=qrcode,
+                payment_method=payment_method,
+                people_count=people_count,
+                email=email,
+            )
+            session.add(order)
+            # В режиме одной строки _reserve_event_row возвращает новый
+            # purchased_count, в шардированном сумма читается в той же транзакции
+            if reserve is _reserve_event_row:
+                purchased_count = reserved
+            else:
+                purchased_count = (await session.execute(_sharded_purchased_count(event_id))).scalar_one()
+            await session.commit()
+            await session.refresh(order)
+            break
+    else:
+        raise SeatsUnavailable
+
+    # Кэш устарел, только если режим события не совпал с ожидаемым; переход
+    # с одного шарда на перебор всех — обычная работа у распродажи
+    if (reserve is _reserve_event_row) != (reservations[0] is _reserve_event_row):
+        await invalidate("seat_shards", event_id)
+    await _invalidate_event(event_id, listings=False)
+    return order.id, purchased_count
+
+
+@cached("seat_shards")
+async def get_seat_shard_count(event_id: int) -> int:
     async with new_session() as session:
-        order = Order(
-            event_id=event_id,
-            qrcode=qrcode,
-            payment_method=payment_method,
-            people_count=people_count,
-            email=email,
+        result = await session.execute(
+            select(func.count()).select_from(EventSeatShard).where(EventSeatShard.event_id == event_id)
         )
-        session.add(order)
+        return result.scalar_one()
+
+
+def _sharded_purchased_count(event_id: int):
+    return select(func.coalesce(func.sum(EventSeatShard.sold), 0)).where(EventSeatShard.event_id == event_id)
+
+
+async def get_sharded_purchased_count(event_id: int) -> int:
+    async with new_session() as session:
+        result = await session.execute(_sharded_purchased_count(event_id))
+        return result.scalar_one()
+
+
+async def get_seat_shards(event_id: int) -> list[EventSeatShard]:
+    async with new_session() as session:
+        result = await session.execute(
+            select(EventSeatShard).where(EventSeatShard.event_id == event_id).order_by(EventSeatShard.shard_no)
+        )
+        return list(result.scalars().all())
+
+
+async def get_sharded_event_ids() -> list[int]:
+    async with new_session() as session:
+        result = await session.execute(select(EventSeatShard.event_id).distinct())
+        return [row[0] for row in result.all()]
+
+
+async def _lock_event_for_inventory(session, event_id: int) -> Event | None:
+    # FOR NO KEY UPDATE не конфликтует с KEY SHARE, который берут вставки
+    # заказов через внешний ключ, поэтому заказы не упираются в эту блокировку
+    result = await session.execute(
+        select(Event).where(Event.event_id == event_id).with_for_update(key_share=True)
+    )
+    return result.scalar_one_or_none()
+
+
+def _split(total: int, parts: int) -> list[int]:
+    share, extra = divmod(max(total, 0), parts)
+    return [share + (1 if i < extra else 0) for i in range(parts)]
+
+
+async def set_seat_shards(event_id: int, shard_count: int) -> Event | None:
+    """Включает (shard_count >= 2) или выключает шардированный учёт мест."""
+    async with new_session() as session:
+        event = await _lock_event_for_inventory(session, event_id)
+        if not event:
+            return None
+        shards = (
+            await session.execute(
+                select(EventSeatShard)
+                .where(EventSeatShard.event_id == event_id)
+                .order_by(EventSeatShard.shard_no)
+                .with_for_update()
+            )
+        ).scalars().all()
+        if shards:
+            event.purchased_count = sum(shard.sold for shard in shards)
+            await session.execute(delete(EventSeatShard).where(EventSeatShard.event_id == event_id))
+        if shard_count >= 2:
+            sold = _split(event.purchased_count, shard_count)
+            free = _split(event.seats_total - event.purchased_count, shard_count)
+            session.add_all(
+                EventSeatShard(event_id=event_id, shard_no=i, capacity=sold[i] + free[i], sold=sold[i])
+                for i in range(shard_count)
+            )
+        event.sharded = shard_count >= 2
         await session.commit()
-        await session.refresh(order)
-        return order.id
+        await session.refresh(event)
+    await invalidate("seat_shards", event_id)
+    await _invalidate_event(event_id)
+    return event
 
 
-async def get_order_emails_by_event(event_id: int) -> list[str]:
+async def rebalance_seat_shards(event_id: int) -> int | None:
+    """Поровну раздаёт свободные места по шардам и пишет сумму продаж в purchased_count."""
     async with new_session() as session:
+        event = await _lock_event_for_inventory(session, event_id)
+        if not event:
+            return None
+        shards = (
+            await session.execute(
+                select(EventSeatShard)
+                .where(EventSeatShard.event_id == event_id)
+                .order_by(EventSeatShard.shard_no)
+                .with_for_update()
+            )
+        ).scalars().all()
+        if not shards:
+            return None
+        total_sold = sum(shard.sold for shard in shards)
+        free = _split(event.seats_total - total_sold, len(shards))
+        for shard, extra in zip(shards, free):
+            shard.capacity = shard.sold + extra
+        event.purchased_count = total_sold
+        await session.commit()
+    await _invalidate_event(event_id, listings=False)
+    return total_sold
+
+
+async def get_order_emails_by_event(event_id: int) -> list[str]:
+    async with new_read_session() as session:
         query = select(Order.email).filter_by(event_id=event_id)
         result = await session.execute(query)
         return [row[0] for row in result.all()]
 
 
 async def get_all_users_from_db() -> list[User]:
-    async with new_session() as session:
+    async with new_read_session() as session:
         result = await session.execute(select(User))
         return list(result.scalars().all())
 
 
+# Точный count(*) по миллиону строк стоит дороже самой страницы: считаем
+# точно только до этого порога, дальше берём оценку планировщика
+ADMIN_EXACT_COUNT_LIMIT = 10_000
+
+USER_SORT_KEYS = {
+    "created_at": (User.created_at, User.id),
+    "id": (User.id,),
+    "email": (User.email,),
+}
+ORDER_SORT_KEYS = {
+    "id": (Order.id,),
+}
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _prefix_conditions(column, prefix: str) -> list:
+    # Префикс как диапазон в collation "C": в отличие от LIKE $1 индекс
+    # используется и в generic-плане подготовленного запроса
+    value = func.lower(column).collate("C")
+    prefix = prefix.lower()
+    if "\x00" in prefix or any(0xD800 <= ord(char) <= 0xDFFF for char in prefix):
+        # Таких символов не бывает в тексте Postgres: совпадений заведомо нет
+        return [false()]
+    conditions = [value >= prefix]
+    # Верхняя граница — префикс с увеличенным последним символом. U+10FFFF
+    # увеличить нельзя, его отбрасываем; суррогаты перескакиваем. Префикс
+    # из одних U+10FFFF ограничен только снизу
+    upper = prefix.rstrip(chr(0x10FFFF))
+    if upper:
+        code = ord(upper[-1]) + 1
+        if 0xD800 <= code <= 0xDFFF:
+            code = 0xE000
+        conditions.append(value < upper[:-1] + chr(code))
+    return conditions
+
+
+def _keyset_page(query, sort_columns, descending: bool, after: tuple | None, limit: int):
+    if after is not None:
+        key, values = tuple_(*sort_columns), tuple_(*after)
+        query = query.where(key < values if descending else key > values)
+    order = [column.desc() if descending else column.asc() for column in sort_columns]
+    return query.order_by(*order).limit(limit)
+
+
+async def _count_rows(session, query) -> tuple[int, bool]:
+    """Возвращает (число строк, точное ли оно) для запроса с фильтрами."""
+    capped = query.with_only_columns(literal(1), maintain_column_froms=True).order_by(None).limit(ADMIN_EXACT_COUNT_LIMIT + 1).subquery()
+    count = (await session.execute(select(func.count()).select_from(capped))).scalar_one()
+    if count <= ADMIN_EXACT_COUNT_LIMIT:
+        return count, True
+    connection = await session.connection()
+    compiled = query.with_only_columns(literal(1), maintain_column_froms=True).order_by(None).compile(dialect=connection.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup or ())
+    result = await connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + compiled.string, params)
+    plan = result.scalar_one()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return max(int(plan[0]["Plan"]["Plan Rows"]), count), False
+
+
+def _user_filters(
+    role: str | None = None,
+    status: str | None = None,
+    email_prefix: str | None = None,
+    name: str | None = None,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+) -> list:
+    conditions = []
+    if role is not None:
+        conditions.append(User.role == role)
+    if status is not None:
+        conditions.append(User.status == status)
+    if email_prefix:
+        conditions.extend(_prefix_conditions(User.email, email_prefix))
+    if name:
+        conditions.append(User.display_name.ilike("%" + _escape_like(name) + "%", escape="\\"))
+    if created_from is not None:
+        if created_from.tzinfo is not None:
+            created_from = created_from.astimezone(timezone.utc).replace(tzinfo=None)
+        conditions.append(User.created_at >= created_from)
+    if created_to is not None:
+        if created_to.tzinfo is not None:
+            created_to = created_to.astimezone(timezone.utc).replace(tzinfo=None)
+        conditions.append(User.created_at <= created_to)
+    return conditions
+
+
+async def get_users_page_from_db(
+    sort: str = "created_at",
+    descending: bool = True,
+    after: tuple | None = None,
+    limit: int = 50,
+    with_total: bool = True,
+    **filters,
+) -> tuple[list[User], int | None, bool]:
+    base = select(User).where(*_user_filters(**filters))
+    async with new_read_session() as session:
+        result = await session.execute(_keyset_page(base, USER_SORT_KEYS[sort], descending, after, limit))
+        users = list(result.scalars().all())
+        total, exact = await _count_rows(session, base) if with_total else (None, True)
+    return users, total, exact
+
+
 async def get_all_user_emails_from_db(status: str | None = None) -> list[str]:
-    async with new_session() as session:
+    async with new_read_session() as session:
         query = select(User.email)
         if status:
             query = query.filter_by(status=status)
@@ -168,11 +752,13 @@ async def get_all_user_emails_from_db(status: str | None = None) -> list[str]:
         return [row[0] for row in result.all()]
 
 
+@cached("user")
+async def _get_user_values(email: str) -> dict | None:
+    return await _load_row(User, User.email == email)
+
+
 async def get_user_by_email(email: str) -> User | None:
-    async with new_session() as session:
-        query = select(User).filter_by(email=email)
-        result = await session.execute(query)
-        return result.scalar_one_or_none()
+    return _detached(User, await _get_user_values(email))
 
 
 async def create_user_in_db(email: str, display_name: str | None = None, phone: str | None = None, role: str = "user") -> User:
@@ -188,6 +774,8 @@ async def create_user_in_db(email: str, display_name: str | None = None, phone:
         try:
             await session.commit()
             await session.refresh(user)
+            # get_user_by_email мог закэшировать отсутствие пользователя
+            await invalidate("user", email)
             return user
         except SAIntegrityError:
             await session.rollback()
@@ -208,6 +796,7 @@ async def ensure_admin_user(admin_email: str):
             session.add(user)
             await session.commit()
             await session.refresh(user)
+            await invalidate("user", user.email)
             return user
         updated = False
         if user.role != "admin":
@@ -219,6 +808,7 @@ async def ensure_admin_user(admin_email: str):
         if updated:
             await session.commit()
             await session.refresh(user)
+            await invalidate("user", user.email)
         return user
 
 
@@ -228,6 +818,7 @@ async def update_user_in_db(
     phone: str | None = None,
     role: str | None = None,
     status: str | None = None,
+    profile_image: str | None = None,
 ) -> User | None:
     async with new_session() as session:
         query = select(User).filter_by(id=user_id)
@@ -243,8 +834,11 @@ async def update_user_in_db(
             user.role = role
         if status is not None:
             user.status = status
+        if profile_image is not None:
+            user.profile_image = profile_image
         await session.commit()
         await session.refresh(user)
+        await invalidate("user", user.email)
         return user
 
 
@@ -258,6 +852,7 @@ async def soft_delete_user_in_db(user_id: int) -> User | None:
         user.status = "deleted"
         await session.commit()
         await session.refresh(user)
+        await invalidate("user", user.email)
         return user
 
 
@@ -296,6 +891,7 @@ async def update_event_in_db(
             event.name = name
         if place is not None:
             event.place = place
+        old_city = event.city
         if city is not None:
             event.city = city
         if event_time is not None:
@@ -321,15 +917,83 @@ async def update_event_in_db(
 
         await session.commit()
         await session.refresh(event)
+        await _invalidate_event(event_id)
+        await _invalidate_expect(old_city, event.city)
         return event
 
 
 async def get_all_orders_from_db() -> list[Order]:
-    async with new_session() as session:
+    async with new_read_session() as session:
         result = await session.execute(select(Order))
         return list(result.scalars().all())
 
 
+def _order_filters(
+    event_id: int | None = None,
+    payment_method: str | None = None,
+    email_prefix: str | None = None,
+) -> list:
+    conditions = []
+    if event_id is not None:
+        conditions.append(Order.event_id == event_id)
+    if payment_method is not None:
+        conditions.append(Order.payment_method == payment_method)
+    if email_prefix:
+        conditions.extend(_prefix_conditions(Order.email, email_prefix))
+    return conditions
+
+
+async def get_orders_page_from_db(
+    sort: str = "id",
+    descending: bool = True,
+    after: tuple | None = None,
+    limit: int = 50,
+    with_total: bool = True,
+    **filters,
+) -> tuple[list[Order], int | None, bool]:
+    base = select(Order).where(*_order_filters(**filters))
+    async with new_read_session() as session:
+        result = await session.execute(_keyset_page(base, ORDER_SORT_KEYS[sort], descending, after, limit))
+        orders = list(result.scalars().all())
+        total, exact = await _count_rows(session, base) if with_total else (None, True)
+    return orders, total, exact
+
+
+USER_EXPORT_COLUMNS = (
+    User.id,
+    User.email,
+    User.display_name,
+    User.phone,
+    User.role,
+    User.status,
+    User.created_at,
+    User.profile_image,
+)
+ORDER_EXPORT_COLUMNS = (
+    Order.id,
+    Order.event_id,
+    Order.payment_method,
+    Order.people_count,
+    Order.email,
+    Order.qrcode,
+    Order.created_at,
+    Order.unit_price,
+)
+EVENT_EXPORT_COLUMNS = tuple(column for column in Event.__table__.columns)
+
+
+async def stream_rows(columns, batch_size: int = 1000) -> AsyncIterator[list[tuple]]:
+    """Отдаёт строки таблицы пачками через серверный курсор.
+
+    В памяти держится только текущая пачка, сколько бы строк ни было в таблице.
+    """
+    query = select(*columns).order_by(columns[0]).execution_options(yield_per=batch_size)
+    async with new_read_session() as session:
+        result = await session.stream(query)
+        async for partition in result.partitions():
+            yield [tuple(row) for row in partition]
+
+
 async def update_order_in_db(
     order_id: int,
     qrcode: str | None = None,
@@ -351,4 +1015,188 @@ async def update_order_in_db(
         await session.commit()
         await session.refresh(order)
         return order
-    
\ No newline at end of file
+
+
+async def enqueue_emails_in_db(messages: list[tuple[str, str, str]]) -> int:
+    if not messages:
+        return 0
+    async with new_session() as session:
+        await session.execute(
+            insert(EmailOutbox),
+            [
+                {"to_email": to_email, "subject": subject, "body": body}
+                for to_email, subject, body in messages
+            ],
+        )
+        await session.commit()
+        return len(messages)
+
+
+async def claim_email_batch(limit: int, lease_seconds: float) -> list[EmailOutbox]:
+    """Забирает пачку готовых к отправке писем.
+
+    Строки не блокируются на время отправки: им сдвигается next_attempt_at
+    на время аренды, и если воркер упадёт, письмо снова станет видно
+    остальным после её истечения.
+    """
+    now = datetime.utcnow()
+    async with new_session() as session:
+        ready = (
+            select(EmailOutbox.id)
+            .where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+            .order_by(EmailOutbox.next_attempt_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        result = await session.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.id.in_(ready.scalar_subquery()))
+            .values(
+                attempts=EmailOutbox.attempts + 1,
+                next_attempt_at=now + timedelta(seconds=lease_seconds),
+            )
+            .returning(EmailOutbox)
+        )
+        claimed = list(result.scalars().all())
+        await session.commit()
+        return claimed
+
+
+async def delete_sent_emails(email_ids: list[int]):
+    if not email_ids:
+        return
+    async with new_session() as session:
+        await session.execute(delete(EmailOutbox).where(EmailOutbox.id.in_(email_ids)))
+        await session.commit()
+
+
+async def mark_email_failed(email_id: int, error: str, retry_at: datetime | None):
+    async with new_session() as session:
+        values = {"last_error": error}
+        if retry_at is None:
+            values["status"] = "dead"
+        else:
+            values["next_attempt_at"] = retry_at
+        await session.execute(update(EmailOutbox).where(EmailOutbox.id == email_id).values(**values))
+        await session.commit()
+
+
+async def claim_idempotency_key(
+    scope: str, key: str, request_hash: str, ttl_seconds: float, lease_seconds: float
+) -> bool:
+    """Занимает ключ; False — ключ уже занят живой записью.
+
+    Занять заново можно просроченную запись, а также запись без ответа с
+    тем же телом запроса, чья аренда истекла (обработчик упал или завис).
+    """
+    now = datetime.utcnow()
+    stmt = pg_insert(IdempotencyKey).values(
+        scope=scope,
+        key=key,
+        request_hash=request_hash,
+        response=None,
+        expires_at=now + timedelta(seconds=ttl_seconds),
+        locked_until=now + timedelta(seconds=lease_seconds),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IdempotencyKey.scope, IdempotencyKey.key],
+        set_={
+            "request_hash": stmt.excluded.request_hash,
+            "response": None,
+            "expires_at": stmt.excluded.expires_at,
+            "locked_until": stmt.excluded.locked_until,
+        },
+        where=or_(
+            IdempotencyKey.expires_at < now,
+            and_(
+                IdempotencyKey.response.is_(None),
+                IdempotencyKey.request_hash == stmt.excluded.request_hash,
+                or_(IdempotencyKey.locked_until.is_(None), IdempotencyKey.locked_until < now),
+            ),
+        ),
+    ).returning(IdempotencyKey.key)
+    async with new_session() as session:
+        result = await session.execute(stmt)
+        await session.commit()
+        return result.scalar_one_or_none() is not None
+
+
+async def get_idempotency_record(scope: str, key: str) -> IdempotencyKey | None:
+    async with new_session() as session:
+        result = await session.execute(select(IdempotencyKey).filter_by(scope=scope, key=key))
+        return result.scalar_one_or_none()
+
+
+async def save_idempotency_response(scope: str, key: str, response: str):
+    async with new_session() as session:
+        await session.execute(
+            update(IdempotencyKey).filter_by(scope=scope, key=key).values(response=response, locked_until=None)
+        )
+        await session.commit()
+
+
+async def release_idempotency_key(scope: str, key: str):
+    async with new_session() as session:
+        await session.execute(delete(IdempotencyKey).filter_by(scope=scope, key=key))
+        await session.commit()
+
+
+async def delete_expired_idempotency_keys() -> int:
+    async with new_session() as session:
+        result = await session.execute(
+            delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.utcnow())
+        )
+        await session.commit()
+        return result.rowcount
+
+
+def _sales_columns(table) -> list:
+    return [
+        func.sum(table.orders_count).label("orders_count"),
+        func.sum(table.seats_sold).label("seats_sold"),
+        func.sum(table.revenue).label("revenue"),
+    ]
+
+
+def _sales_row(row) -> dict:
+    sales = dict(row._mapping)
+    sales["orders_count"] = sales["orders_count"] or 0
+    sales["seats_sold"] = sales["seats_sold"] or 0
+    sales["revenue"] = float(sales["revenue"] or 0)
+    return sales
+
+
+async def get_event_sales_from_db(event_id: int) -> dict:
+    """Продажи события из агрегатов: суммы по шардам, без скана orders."""
+    async with new_read_session() as session:
+        totals = (
+            await session.execute(select(*_sales_columns(EventSales)).where(EventSales.event_id == event_id))
+        ).one()
+        by_payment = await session.execute(
+            select(EventSalesByPayment.payment_method, *_sales_columns(EventSalesByPayment))
+            .where(EventSalesByPayment.event_id == event_id)
+            .group_by(EventSalesByPayment.payment_method)
+            .order_by(EventSalesByPayment.payment_method)
+        )
+        by_day = await session.execute(
+            select(EventSalesByDay.day, *_sales_columns(EventSalesByDay))
+            .where(EventSalesByDay.event_id == event_id)
+            .group_by(EventSalesByDay.day)
+            .order_by(EventSalesByDay.day)
+        )
+        return {
+            **_sales_row(totals),
+            "by_payment_method": [_sales_row(row) for row in by_payment],
+            "by_day": [_sales_row(row) for row in by_day],
+        }
+
+
+async def get_city_sales_from_db() -> list[dict]:
+    async with new_read_session() as session:
+        result = await session.execute(
+            select(CitySales.city, *_sales_columns(CitySales))
+            .group_by(CitySales.city)
+            .having(func.sum(CitySales.orders_count) != 0)
+            .order_by(func.sum(CitySales.revenue).desc(), CitySales.city)
+        )
+        return [_sales_row(row) for row in result]
@@ -1,8 +1,16 @@
-from datetime import datetime
+from datetime import date, datetime
 
-from sqlalchemy import DateTime, Integer, Numeric, String, Text, ForeignKey
+from sqlalchemy import Boolean, Date, DateTime, Index, Integer, Numeric, String, Text, ForeignKey, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
+# Документ полнотекстового поиска по событию. Выражение должно совпадать
+# байт в байт с тем, что использует crud.search_events, иначе Postgres
+# не сможет применить GIN-индекс.
+EVENT_SEARCH_DOCUMENT = (
+    "to_tsvector('russian', coalesce(name, '') || ' ' || coalesce(place, '') || ' ' "
+    "|| coalesce(city, '') || ' ' || coalesce(description, ''))"
+)
+
 class Base(DeclarativeBase):
     pass
 
@@ -24,8 +32,33 @@ class Event(Base):
     message_link: Mapped[str] = mapped_column(String(1024), nullable=True)
     purchased_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     seats_total: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Места учитываются в event_seat_shards, purchased_count лишь их сумма.
+    # Флаг в самой строке: условный UPDATE перепроверяет его после ожидания
+    # блокировки, а подзапрос к event_seat_shards видел бы старый снимок
+    sharded: Mapped[bool] = mapped_column(Boolean, nullable=False, default=False, server_default=text("false"))
     account_id: Mapped[int] = mapped_column(Integer, nullable=False)
 
+    __table_args__ = (
+        Index("ix_short_urls_event_time_event_id", "event_time", "event_id"),
+        Index("ix_short_urls_city_event_time", "city", "event_time", "event_id"),
+        Index("ix_short_urls_event_type_event_time", "event_type", "event_time", "event_id"),
+        Index("ix_short_urls_status_event_time", "status", "event_time", "event_id"),
+        Index("ix_short_urls_account_event_time", "account_id", "event_time", "event_id"),
+        Index("ix_short_urls_search_document", text(EVENT_SEARCH_DOCUMENT), postgresql_using="gin"),
+        Index(
+            "ix_short_urls_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+        Index(
+            "ix_short_urls_place_trgm",
+            "place",
+            postgresql_using="gin",
+            postgresql_ops={"place": "gin_trgm_ops"},
+        ),
+    )
+
 
 class Order(Base):
     __tablename__ = "orders"
@@ -36,6 +69,93 @@ class Order(Base):
     payment_method: Mapped[str] = mapped_column(String(50), nullable=False)
     people_count: Mapped[int] = mapped_column(Integer, nullable=False)
     email: Mapped[str] = mapped_column(String(255), nullable=False)
+    # Заполняются триггером при вставке (migrations.py, sales_aggregates);
+    # у заказов, созданных до появления колонок, created_at пустой
+    created_at: Mapped[datetime | None] = mapped_column(DateTime, default=datetime.utcnow, nullable=True)
+    unit_price: Mapped[float | None] = mapped_column(Numeric(10, 2), nullable=True)
+
+    __table_args__ = (
+        Index("ix_orders_event_id_id", "event_id", "id"),
+        Index("ix_orders_payment_method_id", "payment_method", "id"),
+        Index("ix_orders_email_lower", text('lower(email) COLLATE "C"')),
+    )
+
+
+class EventSeatShard(Base):
+    """Часть вместимости горячего события.
+
+    В шардированном режиме заказы списывают места с случайного шарда,
+    а не со строки short_urls, и блокировки расходятся по N строкам.
+    """
+
+    __tablename__ = "event_seat_shards"
+
+    event_id: Mapped[int] = mapped_column(Integer, ForeignKey("short_urls.event_id", ondelete="CASCADE"), primary_key=True)
+    shard_no: Mapped[int] = mapped_column(Integer, primary_key=True)
+    capacity: Mapped[int] = mapped_column(Integer, nullable=False)
+    sold: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class EventSales(Base):
+    """Агрегаты продаж события. Ведутся триггером на orders, а не запросами.
+
+    Счётчики разложены по шардам (id заказа % 8), чтобы заказы горячего
+    события не упирались в блокировку одной строки; при чтении шарды
+    суммируются. Так же устроены таблицы ниже.
+    """
+
+    __tablename__ = "event_sales"
+
+    event_id: Mapped[int] = mapped_column(Integer, ForeignKey("short_urls.event_id", ondelete="CASCADE"), primary_key=True)
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True)
+    orders_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    seats_sold: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    revenue: Mapped[float] = mapped_column(Numeric(14, 2), nullable=False, default=0)
+
+
+class EventSalesByPayment(Base):
+    __tablename__ = "event_sales_by_payment"
+
+    event_id: Mapped[int] = mapped_column(Integer, ForeignKey("short_urls.event_id", ondelete="CASCADE"), primary_key=True)
+    payment_method: Mapped[str] = mapped_column(String(50), primary_key=True)
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True)
+    orders_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    seats_sold: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    revenue: Mapped[float] = mapped_column(Numeric(14, 2), nullable=False, default=0)
+
+
+class EventSalesByDay(Base):
+    __tablename__ = "event_sales_by_day"
+
+    event_id: Mapped[int] = mapped_column(Integer, ForeignKey("short_urls.event_id", ondelete="CASCADE"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True)
+    orders_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    seats_sold: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    revenue: Mapped[float] = mapped_column(Numeric(14, 2), nullable=False, default=0)
+
+
+class CitySales(Base):
+    __tablename__ = "city_sales"
+
+    city: Mapped[str] = mapped_column(String(255), primary_key=True)
+    shard: Mapped[int] = mapped_column(Integer, primary_key=True)
+    orders_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    seats_sold: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    revenue: Mapped[float] = mapped_column(Numeric(14, 2), nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+
+    scope: Mapped[str] = mapped_column(String(50), primary_key=True)
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    request_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    response: Mapped[str] = mapped_column(Text, nullable=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+    # Пока ответа нет, ключ занят только до этого момента: после падения
+    # воркера повтор с тем же телом перехватывает его, не дожидаясь expires_at
+    locked_until: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
 
 
 class User(Base):
@@ -48,4 +168,40 @@ class User(Base):
     profile_image: Mapped[str] = mapped_column(Text, nullable=True)
     role: Mapped[str] = mapped_column(String(20), nullable=False, default="user")
     status: Mapped[str] = mapped_column(String(20), nullable=False, default="active")
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
\ No newline at end of file
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    # Индексы под постраничный список в админке: фильтр + (created_at, id)
+    __table_args__ = (
+        Index("ix_users_created_at_id", "created_at", "id"),
+        Index("ix_users_role_created_at", "role", "created_at", "id"),
+        Index("ix_users_status_created_at", "status", "created_at", "id"),
+        Index("ix_users_email_lower", text('lower(email) COLLATE "C"')),
+        Index(
+            "ix_users_display_name_trgm",
+            "display_name",
+            postgresql_using="gin",
+            postgresql_ops={"display_name": "gin_trgm_ops"},
+        ),
+    )
+
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    to_email: Mapped[str] = mapped_column(String(255), nullable=False)
+    subject: Mapped[str] = mapped_column(Text, nullable=False)
+    body: Mapped[str] = mapped_column(Text, nullable=False)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="pending")
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error: Mapped[str] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index(
+            "ix_email_outbox_pending",
+            "next_attempt_at",
+            postgresql_where=text("status = 'pending'"),
+        ),
+    )
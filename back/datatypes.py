@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from datetime import datetime
+from pydantic import BaseModel, ConfigDict, Field
+from datetime import date, datetime
 from typing import Literal
 
 class EventCreate(BaseModel):
@@ -49,6 +49,10 @@ class OrderUpdate(BaseModel):
     people_count: int | None = Field(None, ge=0, description="Количество человек")
 
 
+class SeatShardsRequest(BaseModel):
+    shards: int = Field(..., ge=0, le=256, description="Число шардов мест (0 или 1 — выключить)")
+
+
 class UserUpdate(BaseModel):
     display_name: str | None = Field(None, description="Имя пользователя")
     phone: str | None = Field(None, description="Телефон пользователя")
@@ -85,6 +89,136 @@ class PasswordResetConfirm(BaseModel):
     new_password: str = Field(..., min_length=6, description="Новый пароль")
 
 
+class EventsBatchRequest(BaseModel):
+    ids: list[int] = Field(..., min_length=1, max_length=500, description="ID событий")
+
+
 class EventsBetweenRequest(BaseModel):
     start: datetime | None = Field(None, description="Начальная дата (ISO)")
     end: datetime | None = Field(None, description="Конечная дата (ISO)")
+    cursor: str | None = Field(None, description="Курсор следующей страницы из next_cursor")
+    city: str | None = Field(None, description="Город проведения")
+    event_types: list[str] | None = Field(None, description="Типы событий (любой из)")
+    status: str | None = Field(None, description="Статус события")
+    min_price: float | None = Field(None, ge=0, description="Минимальная цена билета")
+    max_price: float | None = Field(None, ge=0, description="Максимальная цена билета")
+    account_id: int | None = Field(None, description="ID аккаунта организатора")
+
+
+class EventOut(BaseModel):
+    # Кроме event_id все поля необязательны: при fields= в ответе только запрошенные
+    event_id: int = Field(..., description="ID события")
+    slug: str | None = Field(None, description="Короткий идентификатор")
+    long_url: str | None = Field(None, description="Полная ссылка на событие")
+    name: str | None = Field(None, description="Название события")
+    place: str | None = Field(None, description="Место проведения")
+    city: str | None = Field(None, description="Город проведения")
+    event_time: datetime | None = Field(None, description="Дата и время начала события")
+    event_end_time: datetime | None = Field(None, description="Дата и время окончания события")
+    status: str | None = Field(None, description="Статус события")
+    price: float | None = Field(None, description="Цена билета")
+    description: str | None = Field(None, description="Описание события")
+    event_type: str | None = Field(None, description="Тип события")
+    message_link: str | None = Field(None, description="Ссылка на сообщение")
+    purchased_count: int | None = Field(None, description="Количество купивших билет")
+    seats_total: int | None = Field(None, description="Количество мест")
+    account_id: int | None = Field(None, description="ID аккаунта организатора")
+
+
+class EventSearchOut(EventOut):
+    rank: float = Field(..., description="Релевантность результата")
+
+
+class EventRecommendationOut(EventOut):
+    source: str = Field(..., description="Кто выбрал событие: ai или fallback")
+
+
+class EventScoredOut(EventOut):
+    score: float = Field(..., description="Скор рекомендации")
+
+
+class EventsRecommendationsOut(BaseModel):
+    items: list[EventScoredOut] = Field(..., description="События по убыванию скора")
+    personalized: bool = Field(..., description="Учтены ли прошлые заказы пользователя")
+
+
+class EventsPageOut(BaseModel):
+    items: list[EventOut] = Field(..., description="События страницы")
+    next_cursor: str | None = Field(None, description="Курсор следующей страницы")
+
+
+class EventsSearchOut(BaseModel):
+    items: list[EventSearchOut] = Field(..., description="Найденные события")
+    next_offset: int | None = Field(None, description="Смещение следующей страницы")
+
+
+class EventsBatchOut(BaseModel):
+    items: list[EventOut] = Field(..., description="Найденные события в порядке запроса")
+    missing: list[int] = Field(..., description="ID, которых нет в базе")
+
+
+class UserOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int = Field(..., description="ID пользователя")
+    email: str = Field(..., description="Почта пользователя")
+    display_name: str | None = Field(None, description="Имя пользователя")
+    phone: str | None = Field(None, description="Телефон пользователя")
+    role: str = Field(..., description="Роль пользователя")
+    status: str | None = Field(None, description="Статус пользователя")
+    created_at: datetime = Field(..., description="Дата регистрации")
+
+
+class UsersPageOut(BaseModel):
+    items: list[UserOut] = Field(..., description="Пользователи страницы")
+    next_cursor: str | None = Field(None, description="Курсор следующей страницы")
+    total: int | None = Field(None, description="Всего пользователей под фильтром")
+    total_exact: bool = Field(..., description="Точное ли значение total")
+
+
+class OrderOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int = Field(..., description="ID заказа")
+    event_id: int = Field(..., description="ID события")
+    qrcode: str = Field(..., description="QR-код заказа")
+    payment_method: str = Field(..., description="Способ оплаты")
+    people_count: int = Field(..., description="Количество человек")
+    email: str | None = Field(None, description="Email покупателя")
+    created_at: datetime | None = Field(None, description="Время заказа")
+    unit_price: float | None = Field(None, description="Цена билета на момент заказа")
+
+
+class OrdersPageOut(BaseModel):
+    items: list[OrderOut] = Field(..., description="Заказы страницы")
+    next_cursor: str | None = Field(None, description="Курсор следующей страницы")
+    total: int | None = Field(None, description="Всего заказов под фильтром")
+    total_exact: bool = Field(..., description="Точное ли значение total")
+
+
+class SalesOut(BaseModel):
+    orders_count: int = Field(..., description="Количество заказов")
+    seats_sold: int = Field(..., description="Продано мест")
+    revenue: float = Field(..., description="Выручка по цене на момент заказа")
+
+
+class SalesByPaymentOut(SalesOut):
+    payment_method: str = Field(..., description="Способ оплаты")
+
+
+class SalesByDayOut(SalesOut):
+    day: date = Field(..., description="День заказа (UTC)")
+
+
+class EventSalesOut(SalesOut):
+    event_id: int = Field(..., description="ID события")
+    by_payment_method: list[SalesByPaymentOut] = Field(..., description="Продажи по способам оплаты")
+    by_day: list[SalesByDayOut] = Field(..., description="Продажи по дням")
+
+
+class CitySalesOut(SalesOut):
+    city: str = Field(..., description="Город")
+
+
+class CitiesSalesOut(BaseModel):
+    items: list[CitySalesOut] = Field(..., description="Города по убыванию выручки")
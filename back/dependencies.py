@@ -50,3 +50,12 @@ async def get_current_user(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Token verification failed: {str(e)}",
         )
+
+
+async def get_optional_user(
+    authorization: Optional[str] = Header(None, alias="Authorization")
+) -> User | None:
+    """Как get_current_user, но без заголовка Authorization возвращает None"""
+    if not authorization:
+        return None
+    return await get_current_user(authorization)
@@ -5,4 +5,22 @@ class NoUrlFoundException (Exception):
     pass
 
 class SlugAlreadyExists (Exception):
-    pass 
\ No newline at end of file
+    pass
+
+class InvalidCursor (Exception):
+    pass
+
+class SeatsUnavailable (Exception):
+    pass
+
+class IdempotencyKeyInProgress (Exception):
+    pass
+
+class IdempotencyKeyMismatch (Exception):
+    pass
+
+class InvalidFields (Exception):
+    pass
+
+class RecommendationUnavailable (Exception):
+    pass
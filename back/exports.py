@@ -0,0 +1,88 @@
+import os
+import io
+import csv
+import asyncio
+import tempfile
+from datetime import datetime
+from typing import AsyncIterator
+
+from crud import stream_rows
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+EXPORT_CHUNK_BYTES = 64 * 1024
+# Предел строк на лист в Excel; дальше начинаем следующий лист
+XLSX_MAX_ROWS = 1_048_576
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def export_filename(name: str, fmt: str) -> str:
+    return f'{name}_{datetime.utcnow().strftime("%Y%m%d_%H%M%S")}Z.{fmt}'
+
+
+async def _csv_chunks(columns, batch_size: int) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM, чтобы Excel открыл кириллицу в UTF-8 без мастера импорта
+    buffer.write("\ufeff")
+    writer.writerow([column.key for column in columns])
+    async for batch in stream_rows(columns, batch_size):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    tail = buffer.getvalue()
+    if tail:
+        yield tail.encode("utf-8")
+
+
+def _append_rows(workbook, state: dict, title: str, header: list[str], rows: list[tuple]):
+    for row in rows:
+        if state["sheet"] is None or state["rows"] >= XLSX_MAX_ROWS:
+            state["sheets"] += 1
+            name = title if state["sheets"] == 1 else f"{title} ({state['sheets']})"
+            state["sheet"] = workbook.create_sheet(name)
+            state["sheet"].append(header)
+            state["rows"] = 1
+        state["sheet"].append(row)
+        state["rows"] += 1
+
+
+def _read_chunk(file) -> bytes:
+    return file.read(EXPORT_CHUNK_BYTES)
+
+
+async def _xlsx_chunks(title: str, columns, batch_size: int) -> AsyncIterator[bytes]:
+    """Собирает книгу в write-only режиме во временный файл и отдаёт его кусками.
+
+    Строки листа openpyxl сразу сбрасывает на диск; в памяти остаётся только
+    таблица уникальных строк, поэтому для самых больших выгрузок лучше CSV.
+    """
+    from openpyxl import Workbook
+
+    header = [column.key for column in columns]
+    workbook = Workbook(write_only=True)
+    state = {"sheet": None, "rows": 0, "sheets": 0}
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        async for batch in stream_rows(columns, batch_size):
+            await asyncio.to_thread(_append_rows, workbook, state, title, header, batch)
+        if state["sheet"] is None:
+            state["sheet"] = workbook.create_sheet(title)
+            state["sheet"].append(header)
+        await asyncio.to_thread(workbook.save, path)
+        with open(path, "rb") as file:
+            while chunk := await asyncio.to_thread(_read_chunk, file):
+                yield chunk
+    finally:
+        os.unlink(path)
+
+
+def export_stream(title: str, columns, fmt: str, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[bytes]:
+    if fmt == "csv":
+        return _csv_chunks(columns, batch_size)
+    return _xlsx_chunks(title, columns, batch_size)
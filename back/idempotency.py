@@ -0,0 +1,131 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+
+from fastapi.encoders import jsonable_encoder
+
+from crud import (
+    claim_idempotency_key,
+    get_idempotency_record,
+    save_idempotency_response,
+    release_idempotency_key,
+    delete_expired_idempotency_keys,
+)
+from exceptions import IdempotencyKeyInProgress, IdempotencyKeyMismatch
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# Сколько ключ без ответа считается «в обработке». Должно быть больше самого
+# долгого обработчика: после истечения повтор выполнит запрос ещё раз
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "60"))
+IDEMPOTENCY_SAVE_ATTEMPTS = 3
+IDEMPOTENCY_CLEANUP_SECONDS = float(os.getenv("IDEMPOTENCY_CLEANUP_SECONDS", "600"))
+
+_cleanup_task: asyncio.Task | None = None
+
+
+def _request_hash(payload: Any) -> str:
+    raw = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def run_idempotent(
+    scope: str,
+    key: str | None,
+    payload: Any,
+    handler: Callable[[], Awaitable[Any]],
+) -> Any:
+    """Выполняет handler не больше одного раза на Idempotency-Key.
+
+    Повтор с тем же ключом и телом получает сохранённый ответ после одного
+    поиска по первичному ключу; тот же ключ с другим телом — ошибка.
+    Если handler упал, ключ освобождается, и клиент может повторить запрос.
+    Если воркер умер посреди обработки, ключ освободится сам через
+    IDEMPOTENCY_LEASE_SECONDS, а не через сутки хранения ответа.
+    """
+    if not key:
+        return await handler()
+
+    request_hash = _request_hash(payload)
+    # Сначала только чтение: повтор с готовым ответом обходится одним
+    # SELECT по первичному ключу, без записи
+    record = await get_idempotency_record(scope, key)
+    if record is None or _claimable(record, request_hash):
+        if await claim_idempotency_key(
+            scope, key, request_hash, IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_LEASE_SECONDS
+        ):
+            return await _run_claimed(scope, key, handler)
+        # Ключ успел занять параллельный запрос
+        record = await get_idempotency_record(scope, key)
+        if record is None:
+            # Запись удалили между попытками (упавший handler или очистка)
+            return await run_idempotent(scope, key, payload, handler)
+    if record.request_hash != request_hash:
+        raise IdempotencyKeyMismatch
+    if record.response is None:
+        raise IdempotencyKeyInProgress
+    return json.loads(record.response)
+
+
+def _claimable(record, request_hash: str) -> bool:
+    # То же условие, что в claim_idempotency_key: просроченная запись или
+    # запись без ответа с тем же телом, чья аренда истекла
+    now = datetime.utcnow()
+    if record.expires_at < now:
+        return True
+    return (
+        record.response is None
+        and record.request_hash == request_hash
+        and (record.locked_until is None or record.locked_until < now)
+    )
+
+
+async def _run_claimed(scope: str, key: str, handler: Callable[[], Awaitable[Any]]) -> Any:
+    try:
+        result = await handler()
+    except BaseException:
+        await release_idempotency_key(scope, key)
+        raise
+    await _save_response(scope, key, json.dumps(jsonable_encoder(result), ensure_ascii=False))
+    return result
+
+
+async def _save_response(scope: str, key: str, response: str):
+    # handler уже выполнен: освобождать ключ нельзя, повтор сделал бы всё
+    # заново. Если сохранить так и не удалось, ключ откроется по истечении аренды
+    for attempt in range(IDEMPOTENCY_SAVE_ATTEMPTS):
+        try:
+            await save_idempotency_response(scope, key, response)
+            return
+        except Exception:
+            if attempt + 1 == IDEMPOTENCY_SAVE_ATTEMPTS:
+                logger.exception("Failed to save idempotent response for %s/%s", scope, key)
+                return
+            await asyncio.sleep(0.1 * 2 ** attempt)
+
+
+async def _cleanup_forever():
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_CLEANUP_SECONDS)
+        try:
+            await delete_expired_idempotency_keys()
+        except Exception:
+            logger.exception("Idempotency key cleanup failed")
+
+
+def start_idempotency_cleanup():
+    global _cleanup_task
+    _cleanup_task = asyncio.create_task(_cleanup_forever())
+
+
+async def stop_idempotency_cleanup():
+    global _cleanup_task
+    if _cleanup_task is not None:
+        _cleanup_task.cancel()
+        await asyncio.gather(_cleanup_task, return_exceptions=True)
+        _cleanup_task = None
@@ -1,9 +1,35 @@
 import os
+import time
 import smtplib
 import asyncio
+import logging
+from datetime import datetime, timedelta
 from email.message import EmailMessage
 from typing import Iterable, Sequence
 
+from crud import enqueue_emails_in_db, claim_email_batch, delete_sent_emails, mark_email_failed
+
+logger = logging.getLogger(__name__)
+
+MAIL_WORKERS = int(os.getenv("MAIL_WORKERS", "2"))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "5"))
+MAIL_POLL_INTERVAL = float(os.getenv("MAIL_POLL_INTERVAL_SECONDS", "1"))
+MAIL_LEASE_SECONDS = float(os.getenv("MAIL_LEASE_SECONDS", "300"))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv("MAIL_RETRY_BASE_SECONDS", "30"))
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", "60"))
+# Таймаут каждой сетевой операции SMTP; письмо с переподключением — до двух таких
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "10"))
+
+_workers: list[asyncio.Task] = []
+_wakeup = asyncio.Event()
+
+
+class _LeaseExpired(Exception):
+    """Аренда письма вот-вот истечёт: его мог забрать другой воркер."""
+
 
 def _smtp_config():
     host = os.getenv("SMTP_HOST")
@@ -26,23 +52,208 @@ def _render_body(lines: Sequence[str]) -> str:
     return header + "\n" + "\n".join(lines) + footer
 
 
-async def _send_email(to_email: str, subject: str, lines: Sequence[str]):
-    cfg = _smtp_config()
+def _build_message(cfg: dict, to_email: str, subject: str, body: str) -> EmailMessage:
     msg = EmailMessage()
     msg["From"] = cfg["from_email"]
     msg["To"] = to_email
     msg["Subject"] = subject
-    msg.set_content(_render_body(lines))
+    msg.set_content(body)
+    return msg
 
-    def _sync_send():
-        with smtplib.SMTP(cfg["host"], cfg["port"], timeout=10) as server:
+
+class _PooledConnection:
+    """Одно авторизованное SMTP-соединение, переиспользуемое между письмами.
+
+    Методы синхронные и вызываются через asyncio.to_thread; одновременно
+    соединением пользуется только один поток — это гарантирует SMTPPool.
+    """
+
+    def __init__(self):
+        self.server: smtplib.SMTP | None = None
+        self.sent = 0
+        self.last_used = 0.0
+
+    def _connect(self, cfg: dict):
+        server = smtplib.SMTP(cfg["host"], cfg["port"], timeout=SMTP_TIMEOUT_SECONDS)
+        try:
             if cfg["use_tls"]:
                 server.starttls()
             if cfg["user"] and cfg["password"]:
                 server.login(cfg["user"], cfg["password"])
-            server.send_message(msg)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+        self.sent = 0
+
+    def send(self, to_email: str, subject: str, body: str):
+        cfg = _smtp_config()
+        msg = _build_message(cfg, to_email, subject, body)
+        # Сервер мог закрыть простаивающее соединение по своему таймауту
+        if self.server is not None and time.monotonic() - self.last_used > SMTP_IDLE_SECONDS:
+            self.close()
+        if self.server is None:
+            self._connect(cfg)
+        try:
+            self.server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            self._connect(cfg)
+            self.server.send_message(msg)
+        self.sent += 1
+        self.last_used = time.monotonic()
+        if self.sent >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+            self.close()
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            self.server.close()
+        self.server = None
+
+
+class SMTPPool:
+    """До size параллельных SMTP-соединений с лимитом писем на соединение."""
+
+    def __init__(self, size: int = SMTP_POOL_SIZE):
+        self.size = size
+        self._idle: asyncio.Queue[_PooledConnection] | None = None
+        self._connections: list[_PooledConnection] = []
+
+    def _queue(self) -> asyncio.Queue:
+        # Очередь создаётся лениво, уже внутри работающего event loop
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for _ in range(self.size):
+                connection = _PooledConnection()
+                self._connections.append(connection)
+                self._idle.put_nowait(connection)
+        return self._idle
+
+    async def send(self, to_email: str, subject: str, body: str, deadline: float | None = None):
+        idle = self._queue()
+        connection = await idle.get()
+        if deadline is not None and time.monotonic() > deadline:
+            idle.put_nowait(connection)
+            raise _LeaseExpired
+        try:
+            await asyncio.to_thread(connection.send, to_email, subject, body)
+        except Exception:
+            # Состояние сессии после ошибки не гарантировано: следующее
+            # письмо на этом слоте откроет соединение заново
+            await asyncio.to_thread(connection.close)
+            raise
+        finally:
+            idle.put_nowait(connection)
+
+    async def send_many(
+        self, messages: Sequence[tuple[str, str, str]], deadline: float | None = None
+    ) -> list[Exception | None]:
+        results = await asyncio.gather(
+            *(self.send(to_email, subject, body, deadline) for to_email, subject, body in messages),
+            return_exceptions=True,
+        )
+        return [result if isinstance(result, Exception) else None for result in results]
+
+    async def close(self):
+        for connection in self._connections:
+            await asyncio.to_thread(connection.close)
+
+
+smtp_pool = SMTPPool()
+
+
+async def _send_bulk(recipients: Iterable[str], subject: str, lines: Sequence[str]):
+    """Ставит письма в очередь email_outbox; отправляют их фоновые воркеры."""
+    body = _render_body(lines)
+    await enqueue_emails_in_db([(email, subject, body) for email in recipients])
+    _wakeup.set()
+
+
+async def _send_email(to_email: str, subject: str, lines: Sequence[str]):
+    await _send_bulk([to_email], subject, lines)
 
-    await asyncio.to_thread(_sync_send)
+
+def _retry_at(attempts: int) -> datetime | None:
+    if attempts >= MAIL_MAX_ATTEMPTS:
+        return None
+    delay = min(MAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1), 3600)
+    return datetime.utcnow() + timedelta(seconds=delay)
+
+
+def _batch_send_budget(workers: int) -> float:
+    # Худший случай: пачки всех воркеров стоят в очереди к SMTP_POOL_SIZE
+    # соединениям, и каждое письмо упирается в таймаут с переподключением
+    rounds = -(-workers * MAIL_BATCH_SIZE // SMTP_POOL_SIZE)
+    return rounds * 2 * SMTP_TIMEOUT_SECONDS
+
+
+def check_mail_lease(workers: int = MAIL_WORKERS):
+    budget = _batch_send_budget(workers)
+    if MAIL_LEASE_SECONDS <= budget:
+        raise RuntimeError(
+            f"MAIL_LEASE_SECONDS={MAIL_LEASE_SECONDS:g} must exceed the worst-case batch send time "
+            f"{budget:g}s ({workers} workers x MAIL_BATCH_SIZE={MAIL_BATCH_SIZE} over "
+            f"SMTP_POOL_SIZE={SMTP_POOL_SIZE}, SMTP_TIMEOUT_SECONDS={SMTP_TIMEOUT_SECONDS:g})"
+        )
+
+
+async def _drain_once() -> int:
+    batch = await claim_email_batch(MAIL_BATCH_SIZE, MAIL_LEASE_SECONDS)
+    if not batch:
+        return 0
+    # Письмо, не начатое до этого момента, не отправляем: к концу отправки
+    # аренда истекла бы, и его мог бы забрать и отправить другой воркер
+    deadline = time.monotonic() + MAIL_LEASE_SECONDS - 2 * SMTP_TIMEOUT_SECONDS
+    results = await smtp_pool.send_many([(item.to_email, item.subject, item.body) for item in batch], deadline)
+    sent = []
+    for item, exc in zip(batch, results):
+        if exc is None:
+            sent.append(item.id)
+            continue
+        if isinstance(exc, _LeaseExpired):
+            # Строка снова станет видна после истечения аренды
+            logger.warning("Email %s not sent before its lease ran out, leaving it for retry", item.id)
+            continue
+        retry_at = _retry_at(item.attempts)
+        if retry_at is None:
+            logger.error("Email %s to %s moved to dead letters: %s", item.id, item.to_email, exc)
+        await mark_email_failed(item.id, repr(exc), retry_at)
+    await delete_sent_emails(sent)
+    return len(batch)
+
+
+async def _mail_worker():
+    while True:
+        try:
+            if await _drain_once():
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Mail worker iteration failed")
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=MAIL_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_mail_workers(count: int = MAIL_WORKERS):
+    check_mail_lease(count)
+    for _ in range(count):
+        _workers.append(asyncio.create_task(_mail_worker()))
+
+
+async def stop_mail_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    await smtp_pool.close()
 
 
 def _event_lines(event) -> list[str]:
@@ -127,16 +338,11 @@ async def notify_event_updated(event, participants: Iterable[str]):
         "Данные события были обновлены.",
         * _event_lines(event),
     ]
-    tasks = [
-        _send_email(
-            to_email=email,
-            subject=f"Обновление события «{event.name}»",
-            lines=lines,
-        )
-        for email in set(participants)
-    ]
-    for task in tasks:
-        await task
+    await _send_bulk(
+        recipients=set(participants),
+        subject=f"Обновление события «{event.name}»",
+        lines=lines,
+    )
 
 
 async def notify_event_created(event, recipients: Iterable[str]):
@@ -144,16 +350,11 @@ async def notify_event_created(event, recipients: Iterable[str]):
         "Создано новое событие.",
         * _event_lines(event),
     ]
-    tasks = [
-        _send_email(
-            to_email=email,
-            subject=f"Новое событие «{event.name}»",
-            lines=lines,
-        )
-        for email in set(recipients)
-    ]
-    for task in tasks:
-        await task
+    await _send_bulk(
+        recipients=set(recipients),
+        subject=f"Новое событие «{event.name}»",
+        lines=lines,
+    )
 
 
 async def notify_event_before_start(event, recipients: Iterable[str]):
@@ -161,16 +362,23 @@ async def notify_event_before_start(event, recipients: Iterable[str]):
         "Напоминание: событие стартует менее чем через 24 часа.",
         * _event_lines(event),
     ]
-    tasks = [
-        _send_email(
-            to_email=email,
-            subject=f"Напоминание о событии «{event.name}»",
-            lines=lines,
-        )
-        for email in set(recipients)
-    ]
-    for task in tasks:
-        await task
+    await _send_bulk(
+        recipients=set(recipients),
+        subject=f"Напоминание о событии «{event.name}»",
+        lines=lines,
+    )
+
+
+async def notify_events_imported(recipients: Iterable[str], inserted: int, failed: int):
+    await _send_bulk(
+        recipients=set(recipients),
+        subject=f"Импортировано событий: {inserted}",
+        lines=[
+            "Завершён массовый импорт событий.",
+            f"Добавлено: {inserted}",
+            f"Отклонено строк: {failed}",
+        ],
+    )
 
 
 def admin_emails() -> list[str]:
@@ -1,16 +1,19 @@
 
+import time
+
+_import_started = time.perf_counter()
+
 import os
-import io
+import math
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, Header, HTTPException, Query, Request, status
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from ai_service import expect_ai
-from database.db import engine, new_session
-from database.models import Base, User, Event
+from ai_service import expect_ai, close_ai_client
+from database.db import new_session, pool_stats, begin_request, replica_engines, REPLICA_STICKY_SECONDS
+from database.models import User, Event
 from sqlalchemy import select
 from contextlib import asynccontextmanager
-from sqlalchemy import text
 from service import (
     add_event,
     create_order,
@@ -21,10 +24,23 @@ from service import (
     send_event_reminder,
     send_event_created_broadcast,
     get_event_details_by_id,
+    get_events_details_by_ids,
     list_events_between_dates,
+    list_events_page,
+    search_events_by_text,
+    parse_event_fields,
     get_all_orders,
     get_all_users,
-    get_preview
+    list_users_page,
+    list_orders_page,
+    get_preview,
+    configure_seat_shards,
+    get_event_inventory,
+    start_seat_rebalancer,
+    stop_seat_rebalancer,
+    import_events,
+    get_event_sales,
+    get_city_sales,
 )
 from auth_services import (
     login_user,
@@ -32,40 +48,91 @@ from auth_services import (
     send_verification_email,
     send_password_reset_email,
     confirm_password_reset,
-    require_api_key
+    require_api_key,
+    start_http_client,
+    close_http_client,
+)
+from exceptions import (
+    NoUrlFoundException,
+    InvalidCursor,
+    InvalidFields,
+    SeatsUnavailable,
+    IdempotencyKeyInProgress,
+    IdempotencyKeyMismatch,
 )
-from exceptions import NoUrlFoundException
+from idempotency import run_idempotent, start_idempotency_cleanup, stop_idempotency_cleanup
 from fastapi import Depends
 from datatypes import *
-from dependencies import get_current_user
+from dependencies import get_current_user, get_optional_user
 from crud import get_user_by_email, update_user_in_db
 from crud import ensure_admin_user
+from crud import USER_EXPORT_COLUMNS, ORDER_EXPORT_COLUMNS, EVENT_EXPORT_COLUMNS
+from exports import MEDIA_TYPES, export_filename, export_stream
+from cache import cache
+from mail_services import start_mail_workers, stop_mail_workers
+from recommender import recommender, start_recommender, stop_recommender
+from migrations import ensure_schema
+from startup import StartupReport
+
+startup = StartupReport(started=_import_started)
+startup.record("imports", time.perf_counter() - _import_started)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    async with engine.begin() as connection: 
-       await connection.run_sync(Base.metadata.create_all)
-    
-    try:
-        async with engine.begin() as conn:
-            result = await conn.execute(text("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name='users' AND column_name='profile_image'
-            """))
-            if result.scalar() is None:
-                await conn.execute(text("ALTER TABLE users ADD COLUMN profile_image TEXT"))
-    except Exception as e:
-        print(f"Warning: Could not add columns (they might already exist): {e}")
+    with startup.phase("schema"):
+        await ensure_schema()
+    with startup.phase("cache"):
+        await cache.connect()
+    with startup.phase("http_client"):
+        await start_http_client()
+    with startup.phase("background_tasks"):
+        start_mail_workers()
+        start_seat_rebalancer()
+        start_idempotency_cleanup()
+        start_recommender()
     admin_email = os.getenv("ADMIN_EMAIL", "")
     if admin_email:
-        await ensure_admin_user(admin_email)
+        with startup.phase("admin_user"):
+            await ensure_admin_user(admin_email)
+    startup.finish()
     yield
+    await stop_recommender()
+    await stop_idempotency_cleanup()
+    await stop_seat_rebalancer()
+    await stop_mail_workers()
+    await close_http_client()
+    await close_ai_client()
+    await cache.close()
 
 
 app = FastAPI(lifespan=lifespan)
 
+# Метка "читать с primary до" после записи: cookie для браузера на том же
+# домене и одноимённый заголовок для остальных клиентов. Веб-клиент живёт на
+# другом домене без credentials и возвращает заголовок сам (apiFetch в
+# web/src/config/api.js)
+PRIMARY_UNTIL = "x-primary-until"
+
+
+async def replica_stickiness(request: Request, call_next):
+    try:
+        until = float(request.headers.get(PRIMARY_UNTIL) or request.cookies.get(PRIMARY_UNTIL) or 0)
+    except ValueError:
+        until = 0
+    state = begin_request(sticky=until > time.time())
+    response = await call_next(request)
+    if state["wrote"]:
+        until = f"{time.time() + REPLICA_STICKY_SECONDS:.3f}"
+        response.headers[PRIMARY_UNTIL] = until
+        response.set_cookie(PRIMARY_UNTIL, until, max_age=math.ceil(REPLICA_STICKY_SECONDS), httponly=True, samesite="lax")
+    return response
+
+
+# Без реплик все чтения и так идут в primary, middleware не нужен
+if replica_engines:
+    app.middleware("http")(replica_stickiness)
+
 origins = [
     "http://localhost:3000",
     "http://localhost:3001",
@@ -83,25 +150,45 @@ app.add_middleware(
 )
 
 
+async def _idempotent(scope: str, key: str | None, payload, handler):
+    try:
+        return await run_idempotent(scope, key, payload, handler)
+    except IdempotencyKeyMismatch:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key was already used with a different request body",
+        )
+    except IdempotencyKeyInProgress:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is still being processed",
+        )
+
+
 @app.post("/add_event")
-async def create_event(event: EventCreate):
-    slug = await add_event(
-        long_url=event.long_url,
-        name=event.name,
-        place=event.place,
-        city=event.city,
-        event_time=event.event_time,
-        event_end_time=event.event_end_time,
-        status=event.status,
-        price=event.price,
-        description=event.description,
-        event_type=event.event_type,
-        message_link=event.message_link,
-        purchased_count=event.purchased_count,
-        seats_total=event.seats_total,
-        account_id=event.account_id,
-    )
-    return slug
+async def create_event(
+    event: EventCreate,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=255),
+):
+    async def handler():
+        return await add_event(
+            long_url=event.long_url,
+            name=event.name,
+            place=event.place,
+            city=event.city,
+            event_time=event.event_time,
+            event_end_time=event.event_end_time,
+            status=event.status,
+            price=event.price,
+            description=event.description,
+            event_type=event.event_type,
+            message_link=event.message_link,
+            purchased_count=event.purchased_count,
+            seats_total=event.seats_total,
+            account_id=event.account_id,
+        )
+
+    return await _idempotent("add_event", idempotency_key, event, handler)
 
 
 @app.post("/auth/register")
@@ -135,85 +222,188 @@ async def password_reset_confirm(request: PasswordResetConfirm):
     return await confirm_password_reset(oob_code=request.oob_code, new_password=request.new_password)
 
 
-@app.post("/events/between")
-async def events_between_dates(payload: EventsBetweenRequest, limit: int = 100):
-    return await list_events_between_dates(start=payload.start, end=payload.end, limit=limit)
+def _event_fields(fields: str | None):
+    try:
+        return parse_event_fields(fields)
+    except InvalidFields:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown field in fields")
 
 
-@app.post("/order")
-async def create_order(order: OrderCreate):
-    return await create_order(
-        event_id=order.event_id,
-        payment_method=order.payment_method,
-        people_count=order.people_count,
-        email=order.email,
-    )
+@app.post("/events/between", response_model=list[EventOut], response_model_exclude_unset=True)
+async def events_between_dates(
+    payload: EventsBetweenRequest,
+    limit: int = Query(100, ge=1, le=500),
+    fields: str | None = Query(None, max_length=500),
+):
+    try:
+        return await list_events_between_dates(
+            start=payload.start,
+            end=payload.end,
+            limit=limit,
+            cursor=payload.cursor,
+            city=payload.city,
+            event_types=payload.event_types,
+            status=payload.status,
+            min_price=payload.min_price,
+            max_price=payload.max_price,
+            account_id=payload.account_id,
+            fields=_event_fields(fields),
+        )
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
 
 
-@app.get("/users", dependencies=[Depends(require_api_key)])
-async def get_users():
-    users = await get_all_users()
-    return [
-        {
-            "id": u.id,
-            "email": u.email,
-            "display_name": u.display_name,
-            "phone": u.phone,
-            "role": u.role,
-            "status": getattr(u, "status", None),
-            "created_at": u.created_at,
-        }
-        for u in users
-    ]
+@app.post("/events/page", response_model=EventsPageOut, response_model_exclude_unset=True)
+async def events_page(
+    payload: EventsBetweenRequest,
+    limit: int = Query(100, ge=1, le=500),
+    fields: str | None = Query(None, max_length=500),
+):
+    try:
+        return await list_events_page(
+            start=payload.start,
+            end=payload.end,
+            limit=limit,
+            cursor=payload.cursor,
+            city=payload.city,
+            event_types=payload.event_types,
+            status=payload.status,
+            min_price=payload.min_price,
+            max_price=payload.max_price,
+            account_id=payload.account_id,
+            fields=_event_fields(fields),
+        )
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
 
 
-@app.get("/users/export", dependencies=[Depends(require_api_key)])
-async def export_users_xlsx():
-    users = await get_all_users()
-
-    from openpyxl import Workbook
-
-    workbook = Workbook()
-    sheet = workbook.active
-    sheet.title = "Users"
-
-    headers = [
-        "id",
-        "email",
-        "display_name",
-        "phone",
-        "role",
-        "status",
-        "created_at",
-        "profile_image",
-    ]
-    sheet.append(headers)
-
-    for u in users:
-        sheet.append(
-            [
-                u.id,
-                u.email,
-                u.display_name,
-                u.phone,
-                u.role,
-                getattr(u, "status", None),
-                u.created_at,
-                getattr(u, "profile_image", None),
-            ]
+@app.get("/events/search", response_model=EventsSearchOut, response_model_exclude_unset=True)
+async def events_search(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    fields: str | None = Query(None, max_length=500),
+):
+    return await search_events_by_text(query=q, limit=limit, offset=offset, fields=_event_fields(fields))
+
+
+@app.post("/events/batch", response_model=EventsBatchOut, response_model_exclude_unset=True)
+async def events_batch(payload: EventsBatchRequest, fields: str | None = Query(None, max_length=500)):
+    return await get_events_details_by_ids(payload.ids, fields=_event_fields(fields))
+
+
+@app.post("/events/bulk", dependencies=[Depends(require_api_key)])
+async def events_bulk_import(request: Request):
+    """Импорт событий из тела запроса: JSON Lines или CSV (Content-Type: text/csv)."""
+    fmt = "csv" if "csv" in request.headers.get("content-type", "") else "jsonl"
+    return await import_events(request.stream(), fmt)
+
+
+@app.post("/order")
+async def create_order_route(
+    order: OrderCreate,
+    idempotency_key: str | None = Header(None, alias="Idempotency-Key", max_length=255),
+):
+    async def handler():
+        return await create_order(
+            event_id=order.event_id,
+            payment_method=order.payment_method,
+            people_count=order.people_count,
+            email=order.email,
         )
 
-    buffer = io.BytesIO()
-    workbook.save(buffer)
-    buffer.seek(0)
+    try:
+        return await _idempotent("order", idempotency_key, order, handler)
+    except NoUrlFoundException:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Impulse query err: Event not found")
+    except SeatsUnavailable:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Not enough seats left")
+
 
-    filename = f'users_{datetime.utcnow().strftime("%Y%m%d_%H%M%S")}Z.xlsx'
+@app.get("/users", dependencies=[Depends(require_api_key)], response_model=list[UserOut])
+async def get_users():
+    return await get_all_users()
+
+
+@app.get("/users/page", dependencies=[Depends(require_api_key)], response_model=UsersPageOut)
+async def users_page(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = None,
+    sort: str = Query("created_at", pattern="^(created_at|id|email)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    with_total: bool = True,
+    role: str | None = None,
+    status_filter: str | None = Query(None, alias="status"),
+    email: str | None = Query(None, min_length=1, max_length=255),
+    name: str | None = Query(None, min_length=1, max_length=255),
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+):
+    try:
+        return await list_users_page(
+            limit=limit,
+            cursor=cursor,
+            sort=sort,
+            descending=order == "desc",
+            with_total=with_total,
+            role=role,
+            status=status_filter,
+            email_prefix=email,
+            name=name,
+            created_from=created_from,
+            created_to=created_to,
+        )
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+@app.get("/orders/page", dependencies=[Depends(require_api_key)], response_model=OrdersPageOut)
+async def orders_page(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: str | None = None,
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    with_total: bool = True,
+    event_id: int | None = None,
+    payment_method: str | None = None,
+    email: str | None = Query(None, min_length=1, max_length=255),
+):
+    try:
+        return await list_orders_page(
+            limit=limit,
+            cursor=cursor,
+            descending=order == "desc",
+            with_total=with_total,
+            event_id=event_id,
+            payment_method=payment_method,
+            email_prefix=email,
+        )
+    except InvalidCursor:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def _export_response(name: str, title: str, columns, fmt: str) -> StreamingResponse:
+    filename = export_filename(name, fmt)
     return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        export_stream(title, columns, fmt),
+        media_type=MEDIA_TYPES[fmt],
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
+
+@app.get("/users/export", dependencies=[Depends(require_api_key)])
+async def export_users_xlsx(format: str = Query("xlsx", pattern="^(xlsx|csv)$")):
+    return _export_response("users", "Users", USER_EXPORT_COLUMNS, format)
+
+
+@app.get("/orders/export", dependencies=[Depends(require_api_key)])
+async def export_orders(format: str = Query("xlsx", pattern="^(xlsx|csv)$")):
+    return _export_response("orders", "Orders", ORDER_EXPORT_COLUMNS, format)
+
+
+@app.get("/events/export", dependencies=[Depends(require_api_key)])
+async def export_events(format: str = Query("xlsx", pattern="^(xlsx|csv)$")):
+    return _export_response("events", "Events", EVENT_EXPORT_COLUMNS, format)
+
 @app.get("/users/me")
 async def get_current_user_profile(current_user: User = Depends(get_current_user)):
     return {
@@ -292,19 +482,25 @@ async def patch_event(event_id: int, payload: EventUpdate):
     return updated
 
 
-@app.get("/orders", dependencies=[Depends(require_api_key)])
+@app.get("/events/{event_id}/inventory", dependencies=[Depends(require_api_key)])
+async def event_inventory(event_id: int):
+    try:
+        return await get_event_inventory(event_id)
+    except NoUrlFoundException:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Impulse query err: Event not found")
+
+
+@app.post("/events/{event_id}/inventory/shards", dependencies=[Depends(require_api_key)])
+async def event_inventory_shards(event_id: int, payload: SeatShardsRequest):
+    try:
+        return await configure_seat_shards(event_id, payload.shards)
+    except NoUrlFoundException:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Impulse query err: Event not found")
+
+
+@app.get("/orders", dependencies=[Depends(require_api_key)], response_model=list[OrderOut])
 async def get_orders():
-    orders = await get_all_orders()
-    return [
-        {
-            "id": o.id,
-            "event_id": o.event_id,
-            "qrcode": o.qrcode,
-            "payment_method": o.payment_method,
-            "people_count": o.people_count,
-        }
-        for o in orders
-    ]
+    return await get_all_orders()
 
 
 @app.patch("/orders/{order_id}", dependencies=[Depends(require_api_key)])
@@ -328,14 +524,62 @@ async def trigger_event_created(event_id: int):
     return await send_event_created_broadcast(event_id)
 
 
-@app.get("/expect")
-async def expect(city: str):
-    return await expect_ai(city)
+@app.get("/metrics/cache", dependencies=[Depends(require_api_key)])
+async def cache_metrics():
+    return cache.stats()
+
+
+@app.get("/stats/events/{event_id}", dependencies=[Depends(require_api_key)], response_model=EventSalesOut)
+async def event_sales_stats(event_id: int):
+    try:
+        return await get_event_sales(event_id)
+    except NoUrlFoundException:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Impulse query err: Event not found")
+
+
+@app.get("/stats/cities", dependencies=[Depends(require_api_key)], response_model=CitiesSalesOut)
+async def city_sales_stats():
+    return await get_city_sales()
+
+
+@app.get("/metrics/db", dependencies=[Depends(require_api_key)])
+async def db_metrics():
+    return {**pool_stats(), "replicas": [pool_stats(replica) for replica in replica_engines]}
+
+
+@app.get("/metrics/startup", dependencies=[Depends(require_api_key)])
+async def startup_metrics():
+    return startup.as_dict()
+
+
+@app.get("/recommendations", response_model=EventsRecommendationsOut, response_model_exclude_unset=True)
+async def recommendations(
+    city: str | None = Query(None, max_length=255),
+    limit: int = Query(10, ge=1, le=50),
+    current_user: User | None = Depends(get_optional_user),
+):
+    if not recommender.ready:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Recommendations are warming up")
+    email = current_user.email if current_user else None
+    return {"items": recommender.recommend(city=city, email=email, limit=limit), "personalized": email is not None}
+
+
+@app.get("/metrics/recommender", dependencies=[Depends(require_api_key)])
+async def recommender_metrics():
+    return recommender.stats()
+
+
+@app.get("/expect", response_model=EventRecommendationOut)
+async def expect(city: str = Query(..., min_length=1, max_length=255)):
+    try:
+        return await expect_ai(city)
+    except NoUrlFoundException:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No upcoming events in this city")
 
-@app.get("/events/get/{event_id}")
-async def get_event_by_slug(event_id: int):
+@app.get("/events/get/{event_id}", response_model=EventOut, response_model_exclude_unset=True)
+async def get_event_by_slug(event_id: int, fields: str | None = Query(None, max_length=500)):
     try:
-        event = await get_event_details_by_id(event_id=event_id)
+        event = await get_event_details_by_id(event_id=event_id, fields=_event_fields(fields))
     except NoUrlFoundException:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Impulse query err: Event not found")
     return event
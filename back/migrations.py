@@ -0,0 +1,404 @@
+"""Версионные миграции схемы.
+
+Каждая миграция — запись в MIGRATIONS: номер, имя, функция и признак
+concurrent. Номера применённых миграций хранятся в schema_migrations, так что
+при старте воркеру достаточно одного SELECT, чтобы убедиться, что схема
+актуальна.
+
+Применяет миграции ровно один процесс — тот, кто взял advisory-лок;
+остальные ждут, пока он закончит. Обычные миграции выполняются в транзакции.
+Миграции с concurrent=True работают в autocommit: CREATE INDEX CONCURRENTLY
+не блокирует запись в таблицу, но не может идти внутри транзакции.
+
+Базовая миграция создаёт таблицы по текущим моделям, поэтому все следующие
+миграции должны быть идемпотентными (IF NOT EXISTS): на свежей базе их
+колонки и индексы могут уже существовать.
+
+Запуск вручную:
+    cd back
+    python migrations.py
+"""
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, NamedTuple
+
+from sqlalchemy import Index, text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.schema import CreateIndex
+
+from database.db import engine
+from database.models import Base
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_lock, общий для всех процессов приложения
+MIGRATION_LOCK_ID = 7_361_504_211
+MIGRATION_LOCK_POLL_SECONDS = 0.5
+# Выключите, чтобы воркеры не мигрировали сами, а падали при старой схеме
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[AsyncConnection], Awaitable[None]]
+    concurrent: bool = False
+
+
+async def _create_index_concurrently(connection: AsyncConnection, index: Index):
+    valid = (
+        await connection.execute(
+            text(
+                "SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                "WHERE c.relname = :name"
+            ),
+            {"name": index.name},
+        )
+    ).scalar()
+    if valid:
+        return
+    if valid is False:
+        # Остаток прерванного CREATE INDEX CONCURRENTLY: невалидный индекс
+        # только замедляет запись, строим заново
+        await connection.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"')
+    ddl = str(CreateIndex(index).compile(dialect=connection.dialect))
+    ddl = ddl.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1).replace(
+        "CREATE UNIQUE INDEX", "CREATE UNIQUE INDEX CONCURRENTLY", 1
+    )
+    logger.info("Creating index %s", index.name)
+    await connection.exec_driver_sql(ddl)
+
+
+async def _baseline(connection: AsyncConnection):
+    await connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    await connection.run_sync(Base.metadata.create_all)
+
+
+async def _legacy_columns(connection: AsyncConnection):
+    # Бывшие migrate_add_user_columns.py, scripts/add_event_columns.py и
+    # scripts/add_user_status_column.py
+    await connection.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_image TEXT"))
+    await connection.execute(
+        text("ALTER TABLE users ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'active'")
+    )
+    await connection.execute(text("ALTER TABLE short_urls ADD COLUMN IF NOT EXISTS event_type VARCHAR(100)"))
+    await connection.execute(text("ALTER TABLE short_urls ADD COLUMN IF NOT EXISTS message_link VARCHAR(1024)"))
+
+
+async def _model_indexes(connection: AsyncConnection):
+    # create_all не добавляет индексы к уже существующим таблицам
+    for table in Base.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            await _create_index_concurrently(connection, index)
+
+
+SALES_TABLES = ("event_sales", "event_sales_by_payment", "event_sales_by_day", "city_sales")
+# Число шардов агрегатов: строка выбирается по id заказа % SALES_SHARDS
+SALES_SHARDS = 8
+
+_APPLY_ORDER_SALES = f"""
+CREATE OR REPLACE FUNCTION apply_order_sales(o orders, sign integer) RETURNS void AS $$
+DECLARE
+    v_shard integer := o.id % {SALES_SHARDS};
+    v_seats integer := sign * o.people_count;
+    v_revenue numeric := sign * o.people_count * coalesce(o.unit_price, 0);
+    v_city varchar;
+BEGIN
+    INSERT INTO event_sales AS s (event_id, shard, orders_count, seats_sold, revenue)
+    VALUES (o.event_id, v_shard, sign, v_seats, v_revenue)
+    ON CONFLICT (event_id, shard) DO UPDATE SET
+        orders_count = s.orders_count + EXCLUDED.orders_count,
+        seats_sold = s.seats_sold + EXCLUDED.seats_sold,
+        revenue = s.revenue + EXCLUDED.revenue;
+
+    INSERT INTO event_sales_by_payment AS s (event_id, payment_method, shard, orders_count, seats_sold, revenue)
+    VALUES (o.event_id, o.payment_method, v_shard, sign, v_seats, v_revenue)
+    ON CONFLICT (event_id, payment_method, shard) DO UPDATE SET
+        orders_count = s.orders_count + EXCLUDED.orders_count,
+        seats_sold = s.seats_sold + EXCLUDED.seats_sold,
+        revenue = s.revenue + EXCLUDED.revenue;
+
+    IF o.created_at IS NOT NULL THEN
+        INSERT INTO event_sales_by_day AS s (event_id, day, shard, orders_count, seats_sold, revenue)
+        VALUES (o.event_id, o.created_at::date, v_shard, sign, v_seats, v_revenue)
+        ON CONFLICT (event_id, day, shard) DO UPDATE SET
+            orders_count = s.orders_count + EXCLUDED.orders_count,
+            seats_sold = s.seats_sold + EXCLUDED.seats_sold,
+            revenue = s.revenue + EXCLUDED.revenue;
+    END IF;
+
+    -- Город читается без блокировки события: смена города ждёт нашей
+    -- строки event_sales (см. short_urls_move_city_sales), а если она уже
+    -- прошла, новый снимок оператора видит новый город
+    SELECT city INTO v_city FROM short_urls WHERE event_id = o.event_id;
+    INSERT INTO city_sales AS s (city, shard, orders_count, seats_sold, revenue)
+    VALUES (v_city, v_shard, sign, v_seats, v_revenue)
+    ON CONFLICT (city, shard) DO UPDATE SET
+        orders_count = s.orders_count + EXCLUDED.orders_count,
+        seats_sold = s.seats_sold + EXCLUDED.seats_sold,
+        revenue = s.revenue + EXCLUDED.revenue;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+_MOVE_CITY_SALES = f"""
+CREATE OR REPLACE FUNCTION short_urls_move_city_sales() RETURNS trigger AS $$
+DECLARE
+    v_orders integer;
+    v_seats integer;
+    v_revenue numeric;
+BEGIN
+    -- Заказы в полёте уже держат свою строку event_sales. Вставка всех шардов
+    -- ждёт незакоммиченных вставок, FOR UPDATE — обновлений, так что суммы
+    -- ниже включают каждый заказ, записанный на старый город, а новые заказы
+    -- дождутся нашего коммита и увидят новый город
+    INSERT INTO event_sales (event_id, shard, orders_count, seats_sold, revenue)
+    SELECT NEW.event_id, shard, 0, 0, 0 FROM generate_series(0, {SALES_SHARDS - 1}) AS shard
+    ON CONFLICT (event_id, shard) DO NOTHING;
+    PERFORM 1 FROM event_sales WHERE event_id = NEW.event_id FOR UPDATE;
+
+    SELECT sum(orders_count), sum(seats_sold), sum(revenue) INTO v_orders, v_seats, v_revenue
+    FROM event_sales WHERE event_id = NEW.event_id;
+    IF v_orders = 0 THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO city_sales AS s (city, shard, orders_count, seats_sold, revenue)
+    VALUES (OLD.city, 0, -v_orders, -v_seats, -v_revenue), (NEW.city, 0, v_orders, v_seats, v_revenue)
+    ON CONFLICT (city, shard) DO UPDATE SET
+        orders_count = s.orders_count + EXCLUDED.orders_count,
+        seats_sold = s.seats_sold + EXCLUDED.seats_sold,
+        revenue = s.revenue + EXCLUDED.revenue;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+_SALES_FUNCTIONS = (
+    """
+CREATE OR REPLACE FUNCTION orders_fill_sales_fields() RETURNS trigger AS $$
+BEGIN
+    NEW.created_at := coalesce(NEW.created_at, now() AT TIME ZONE 'utc');
+    -- Цена фиксируется на момент заказа: правка цены события не меняет выручку
+    IF NEW.unit_price IS NULL THEN
+        SELECT price INTO NEW.unit_price FROM short_urls WHERE event_id = NEW.event_id;
+    END IF;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+""",
+    _APPLY_ORDER_SALES,
+    """
+CREATE OR REPLACE FUNCTION orders_sales_aggregate() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_order_sales(OLD, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_order_sales(NEW, 1);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+""",
+    _MOVE_CITY_SALES,
+)
+
+_SALES_TRIGGERS = (
+    "DROP TRIGGER IF EXISTS orders_fill_sales_fields ON orders",
+    """
+CREATE TRIGGER orders_fill_sales_fields BEFORE INSERT ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_fill_sales_fields()
+""",
+    "DROP TRIGGER IF EXISTS orders_sales_insert_delete ON orders",
+    """
+CREATE TRIGGER orders_sales_insert_delete AFTER INSERT OR DELETE ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_sales_aggregate()
+""",
+    # Правка qrcode не трогает агрегаты
+    "DROP TRIGGER IF EXISTS orders_sales_update ON orders",
+    """
+CREATE TRIGGER orders_sales_update AFTER UPDATE ON orders
+    FOR EACH ROW WHEN (
+        OLD.event_id IS DISTINCT FROM NEW.event_id
+        OR OLD.people_count IS DISTINCT FROM NEW.people_count
+        OR OLD.payment_method IS DISTINCT FROM NEW.payment_method
+        OR OLD.unit_price IS DISTINCT FROM NEW.unit_price
+        OR OLD.created_at IS DISTINCT FROM NEW.created_at
+    )
+    EXECUTE FUNCTION orders_sales_aggregate()
+""",
+    "DROP TRIGGER IF EXISTS short_urls_move_city_sales ON short_urls",
+    """
+CREATE TRIGGER short_urls_move_city_sales AFTER UPDATE OF city ON short_urls
+    FOR EACH ROW WHEN (OLD.city IS DISTINCT FROM NEW.city)
+    EXECUTE FUNCTION short_urls_move_city_sales()
+""",
+)
+
+_SALES_BACKFILL = (
+    "TRUNCATE event_sales, event_sales_by_payment, event_sales_by_day, city_sales",
+    """
+INSERT INTO event_sales (event_id, shard, orders_count, seats_sold, revenue)
+SELECT event_id, 0, count(*), sum(people_count), sum(people_count * unit_price)
+FROM orders GROUP BY event_id
+""",
+    """
+INSERT INTO event_sales_by_payment (event_id, payment_method, shard, orders_count, seats_sold, revenue)
+SELECT event_id, payment_method, 0, count(*), sum(people_count), sum(people_count * unit_price)
+FROM orders GROUP BY event_id, payment_method
+""",
+    """
+INSERT INTO event_sales_by_day (event_id, day, shard, orders_count, seats_sold, revenue)
+SELECT event_id, created_at::date, 0, count(*), sum(people_count), sum(people_count * unit_price)
+FROM orders WHERE created_at IS NOT NULL GROUP BY event_id, created_at::date
+""",
+    """
+INSERT INTO city_sales (city, shard, orders_count, seats_sold, revenue)
+SELECT e.city, 0, count(*), sum(o.people_count), sum(o.people_count * o.unit_price)
+FROM orders o JOIN short_urls e ON e.event_id = o.event_id GROUP BY e.city
+""",
+)
+
+
+async def _sales_aggregates(connection: AsyncConnection):
+    await connection.execute(text("ALTER TABLE orders ADD COLUMN IF NOT EXISTS created_at TIMESTAMP"))
+    await connection.execute(text("ALTER TABLE orders ADD COLUMN IF NOT EXISTS unit_price NUMERIC(10, 2)"))
+    await connection.run_sync(
+        lambda sync_connection: Base.metadata.create_all(
+            sync_connection, tables=[Base.metadata.tables[name] for name in SALES_TABLES]
+        )
+    )
+    # Заказы, вставленные между пересчётом и коммитом, не должны потеряться
+    # или посчитаться дважды: запись в orders ждёт конца миграции
+    await connection.execute(text("LOCK TABLE orders IN SHARE ROW EXCLUSIVE MODE"))
+    # Цены старых заказов проставляем до создания триггеров, иначе UPDATE
+    # прогнал бы каждую строку через агрегаты, которые всё равно пересчитываются
+    await connection.execute(
+        text(
+            "UPDATE orders o SET unit_price = e.price FROM short_urls e "
+            "WHERE e.event_id = o.event_id AND o.unit_price IS NULL"
+        )
+    )
+    # asyncpg выполняет через exec_driver_sql только одну команду за раз
+    for statement in _SALES_FUNCTIONS + _SALES_TRIGGERS + _SALES_BACKFILL:
+        await connection.exec_driver_sql(statement)
+
+
+async def _seat_shard_flag(connection: AsyncConnection):
+    await connection.execute(
+        text("ALTER TABLE short_urls ADD COLUMN IF NOT EXISTS sharded BOOLEAN NOT NULL DEFAULT false")
+    )
+    await connection.execute(
+        text(
+            "UPDATE short_urls SET sharded = true "
+            "WHERE NOT sharded AND event_id IN (SELECT event_id FROM event_seat_shards)"
+        )
+    )
+
+
+async def _idempotency_lease(connection: AsyncConnection):
+    await connection.execute(text("ALTER TABLE idempotency_keys ADD COLUMN IF NOT EXISTS locked_until TIMESTAMP"))
+
+
+async def _city_sales_share_lock(connection: AsyncConnection):
+    await connection.exec_driver_sql(_APPLY_ORDER_SALES)
+
+
+async def _city_move_locks(connection: AsyncConnection):
+    await connection.exec_driver_sql(_APPLY_ORDER_SALES)
+    await connection.exec_driver_sql(_MOVE_CITY_SALES)
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "baseline", _baseline),
+    Migration(2, "legacy_columns", _legacy_columns),
+    Migration(3, "model_indexes", _model_indexes, concurrent=True),
+    Migration(4, "sales_aggregates", _sales_aggregates),
+    Migration(5, "seat_shard_flag", _seat_shard_flag),
+    Migration(6, "idempotency_lease", _idempotency_lease),
+    Migration(7, "city_sales_share_lock", _city_sales_share_lock),
+    Migration(8, "city_move_locks", _city_move_locks),
+]
+LATEST_VERSION = max(migration.version for migration in MIGRATIONS)
+
+
+async def _applied_versions(connection: AsyncConnection) -> set[int]:
+    exists = (await connection.execute(text("SELECT to_regclass('schema_migrations')"))).scalar()
+    if exists is None:
+        return set()
+    result = await connection.execute(text("SELECT version FROM schema_migrations"))
+    return {row[0] for row in result}
+
+
+async def current_version() -> int:
+    async with engine.connect() as connection:
+        try:
+            result = await connection.execute(text("SELECT coalesce(max(version), 0) FROM schema_migrations"))
+        except ProgrammingError as exc:
+            # Чистая база: таблицы версий ещё нет
+            if getattr(exc.orig, "sqlstate", None) != "42P01":
+                raise
+            return 0
+        return result.scalar_one()
+
+
+async def migrate():
+    """Применяет недостающие миграции под advisory-локом."""
+    async with engine.connect() as lock_connection:
+        await lock_connection.execution_options(isolation_level="AUTOCOMMIT")
+        # Не pg_advisory_lock: ожидающий на нём процесс держит снимок, и
+        # CREATE INDEX CONCURRENTLY у владельца лока ждал бы его вечно
+        while not (
+            await lock_connection.execute(text("SELECT pg_try_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        ).scalar():
+            await asyncio.sleep(MIGRATION_LOCK_POLL_SECONDS)
+        try:
+            await lock_connection.execute(
+                text(
+                    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                    "version INTEGER PRIMARY KEY, "
+                    "name TEXT NOT NULL, "
+                    "applied_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'))"
+                )
+            )
+            applied = await _applied_versions(lock_connection)
+            for migration in MIGRATIONS:
+                if migration.version in applied:
+                    continue
+                logger.info("Applying migration %s_%s", migration.version, migration.name)
+                record = text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)")
+                params = {"version": migration.version, "name": migration.name}
+                if migration.concurrent:
+                    await migration.apply(lock_connection)
+                    await lock_connection.execute(record, params)
+                else:
+                    async with engine.begin() as connection:
+                        await migration.apply(connection)
+                        await connection.execute(record, params)
+        finally:
+            await lock_connection.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+
+async def ensure_schema():
+    """Проверка при старте: один запрос, если схема уже актуальна."""
+    version = await current_version()
+    if version >= LATEST_VERSION:
+        return
+    if not MIGRATE_ON_STARTUP:
+        raise RuntimeError(
+            f"Database schema is at version {version}, expected {LATEST_VERSION}; run python migrations.py"
+        )
+    await migrate()
+
+
+async def _main():
+    logging.basicConfig(level=logging.INFO)
+    await migrate()
+    logger.info("Schema is at version %s", await current_version())
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
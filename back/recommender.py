@@ -0,0 +1,188 @@
+"""Рекомендации событий внутри процесса, без сетевых походов на запрос.
+
+В памяти воркера лежат карточки предстоящих событий и счётчики заказов
+каждого пользователя по типам событий и городам. Скор события складывается из:
+
+    popularity  purchased_count / seats_total
+    recency     насколько скоро событие (вдвое меньше через RECOMMENDER_RECENCY_DAYS)
+    affinity    доля заказов пользователя в этом типе событий
+    city        доля заказов пользователя в этом городе (если город не задан)
+
+Заказы этого процесса учитываются сразу в create_order. Заказы других
+воркеров и новые события подтягиваются опросом по возрастанию id раз в
+RECOMMENDER_POLL_SECONDS. Раз в RECOMMENDER_REBUILD_SECONDS состояние
+строится заново: так подхватываются правки событий и заказы, закоммиченные
+не в порядке id.
+"""
+import os
+import time
+import heapq
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+from crud import load_recommender_snapshot, get_orders_after, get_upcoming_events_after
+
+logger = logging.getLogger(__name__)
+
+RECOMMENDER_POLL_SECONDS = float(os.getenv("RECOMMENDER_POLL_SECONDS", "10"))
+RECOMMENDER_REBUILD_SECONDS = float(os.getenv("RECOMMENDER_REBUILD_SECONDS", "900"))
+RECOMMENDER_RECENCY_DAYS = float(os.getenv("RECOMMENDER_RECENCY_DAYS", "7"))
+RECOMMENDER_ORDERS_BATCH = 1000
+
+WEIGHTS = {"popularity": 0.4, "recency": 0.3, "affinity": 0.2, "city": 0.1}
+
+
+class Recommender:
+    def __init__(self):
+        self.events: dict[int, dict] = {}
+        # Часть скора, не зависящая от пользователя и времени запроса:
+        # event_id -> (WEIGHTS["popularity"] * popularity, начало в секундах epoch)
+        self.base: dict[int, tuple[float, float]] = {}
+        self.by_city: dict[str, set[int]] = defaultdict(set)
+        self.user_types: dict[str, Counter] = defaultdict(Counter)
+        self.user_cities: dict[str, Counter] = defaultdict(Counter)
+        self.last_order_id = 0
+        self.last_event_id = 0
+        # Заказы этого процесса, уже учтённые до того, как их увидел опрос
+        self._recorded: set[int] = set()
+        self.ready = False
+        self.built_at: float | None = None
+        self.orders_applied = 0
+
+    def _update_base(self, event: dict):
+        popularity = min(event["purchased_count"] / event["seats_total"], 1.0) if event["seats_total"] else 1.0
+        starts_at = event["event_time"].replace(tzinfo=timezone.utc).timestamp()
+        self.base[event["event_id"]] = (WEIGHTS["popularity"] * popularity, starts_at)
+
+    def _add_event(self, event: dict):
+        self.events[event["event_id"]] = event
+        self._update_base(event)
+        self.by_city[event["city"]].add(event["event_id"])
+        self.last_event_id = max(self.last_event_id, event["event_id"])
+
+    def _apply_order(self, event_id: int, email: str, people_count: int, city: str, event_type: str | None):
+        event = self.events.get(event_id)
+        if event is not None:
+            event["purchased_count"] += people_count
+            self._update_base(event)
+        self.user_types[email][event_type] += 1
+        self.user_cities[email][city] += 1
+        self.orders_applied += 1
+
+    async def rebuild(self):
+        events, affinity, last_order_id = await load_recommender_snapshot(datetime.utcnow())
+        fresh = Recommender()
+        for event in events:
+            fresh._add_event(event)
+        for email, city, event_type, orders in affinity:
+            fresh.user_types[email][event_type] += orders
+            fresh.user_cities[email][city] += orders
+        # Всё, что записано локально во время загрузки, после подмены
+        # состояния снова придёт опросом: id таких заказов больше last_order_id
+        self.events = fresh.events
+        self.base = fresh.base
+        self.by_city = fresh.by_city
+        self.user_types = fresh.user_types
+        self.user_cities = fresh.user_cities
+        self.last_order_id = last_order_id
+        self.last_event_id = fresh.last_event_id
+        self._recorded.clear()
+        self.built_at = time.monotonic()
+        self.ready = True
+
+    async def poll(self):
+        for event in await get_upcoming_events_after(self.last_event_id, datetime.utcnow()):
+            self._add_event(event)
+        while True:
+            orders = await get_orders_after(self.last_order_id, RECOMMENDER_ORDERS_BATCH)
+            for order_id, event_id, email, people_count, city, event_type in orders:
+                if order_id in self._recorded:
+                    self._recorded.discard(order_id)
+                else:
+                    self._apply_order(event_id, email, people_count, city, event_type)
+                self.last_order_id = order_id
+            if len(orders) < RECOMMENDER_ORDERS_BATCH:
+                break
+        self._recorded = {order_id for order_id in self._recorded if order_id > self.last_order_id}
+
+    def record_order(self, order_id: int, event_id: int, email: str, people_count: int):
+        """Учитывает заказ этого процесса сразу, не дожидаясь опроса."""
+        event = self.events.get(event_id)
+        if not self.ready or event is None or order_id <= self.last_order_id or order_id in self._recorded:
+            return
+        self._recorded.add(order_id)
+        self._apply_order(event_id, email.lower(), people_count, event["city"], event["event_type"])
+
+    def recommend(self, city: str | None = None, email: str | None = None, limit: int = 10) -> list[dict]:
+        now = datetime.now(timezone.utc).timestamp()
+        email = email.lower() if email else None
+        types = self.user_types.get(email) or Counter()
+        cities = self.user_cities.get(email) or Counter()
+        orders_total = sum(types.values())
+        candidates = self.by_city.get(city, ()) if city is not None else self.events.keys()
+        # Веса пользователя считаются один раз на запрос, а не на каждое событие
+        type_weight = {t: WEIGHTS["affinity"] * n / orders_total for t, n in types.items()}
+        if city is not None:
+            city_weight, city_default = {}, WEIGHTS["city"]
+        else:
+            city_weight, city_default = {c: WEIGHTS["city"] * n / orders_total for c, n in cities.items()}, 0.0
+        recency_seconds = RECOMMENDER_RECENCY_DAYS * 86400
+        recency_weight = WEIGHTS["recency"]
+
+        scored = []
+        for event_id in candidates:
+            popularity, starts_at = self.base[event_id]
+            # Прошедшие и распроданные (popularity == вес, то есть мест нет) пропускаем
+            if starts_at < now or popularity >= WEIGHTS["popularity"]:
+                continue
+            event = self.events[event_id]
+            score = (
+                popularity
+                + recency_weight / (1 + (starts_at - now) / recency_seconds)
+                + type_weight.get(event["event_type"], 0.0)
+                + city_weight.get(event["city"], city_default)
+            )
+            scored.append((score, -event_id))
+        best = heapq.nlargest(limit, scored)
+        return [{**self.events[-neg_id], "score": round(score, 6)} for score, neg_id in best]
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "events": len(self.events),
+            "users": len(self.user_types),
+            "last_order_id": self.last_order_id,
+            "orders_applied": self.orders_applied,
+            "built_seconds_ago": time.monotonic() - self.built_at if self.built_at is not None else None,
+        }
+
+    async def run_forever(self):
+        while True:
+            try:
+                if not self.ready or time.monotonic() - self.built_at >= RECOMMENDER_REBUILD_SECONDS:
+                    await self.rebuild()
+                else:
+                    await self.poll()
+            except Exception:
+                logger.exception("Recommender refresh failed")
+            await asyncio.sleep(RECOMMENDER_POLL_SECONDS)
+
+
+recommender = Recommender()
+_recommender_task: asyncio.Task | None = None
+
+
+def start_recommender():
+    # Первая загрузка идёт в фоне и не задерживает старт воркера
+    global _recommender_task
+    _recommender_task = asyncio.create_task(recommender.run_forever())
+
+
+async def stop_recommender():
+    global _recommender_task
+    if _recommender_task is not None:
+        _recommender_task.cancel()
+        await asyncio.gather(_recommender_task, return_exceptions=True)
+        _recommender_task = None
@@ -0,0 +1,118 @@
+"""Load benchmark: seat reservation on one hot event, single-row vs sharded.
+
+Usage:
+    cd back
+    python scripts/bench_seat_shards.py --orders 5000 --concurrency 200 --shards 16
+
+Creates two throwaway events with the same capacity, enables seat shards on
+the second one and fires the same burst of concurrent orders at each through
+crud.create_order_in_db. Prints throughput, latency percentiles and how many
+backends were waiting on row locks (sampled from pg_stat_activity) in each
+mode, then deletes the events and their orders.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, text
+
+from crud import add_slug_to_db, create_order_in_db, set_seat_shards
+from database.db import engine, new_session
+from database.models import Event, Order
+from exceptions import SeatsUnavailable
+from shortener import generate_slug
+
+
+async def _create_event(seats: int) -> int:
+    return await add_slug_to_db(
+        slug=generate_slug(),
+        long_url="https://example.invalid/bench",
+        name="Seat benchmark",
+        place="Bench",
+        city="Bench",
+        event_time=datetime.utcnow() + timedelta(days=30),
+        event_end_time=None,
+        status=None,
+        price=1,
+        description="Throwaway event created by bench_seat_shards.py",
+        purchased_count=0,
+        seats_total=seats,
+        account_id=0,
+    )
+
+
+async def _sample_lock_waits(samples: list[int], stop: asyncio.Event):
+    while not stop.is_set():
+        async with engine.connect() as conn:
+            result = await conn.execute(
+                text("SELECT count(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock'")
+            )
+            samples.append(result.scalar_one())
+        await asyncio.sleep(0.05)
+
+
+async def _run(event_id: int, orders: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    rejected = 0
+
+    async def one():
+        nonlocal rejected
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await create_order_in_db(event_id, "bench", "bench", 1, "bench@example.invalid")
+            except SeatsUnavailable:
+                rejected += 1
+            latencies.append(time.perf_counter() - started)
+
+    samples: list[int] = []
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(_sample_lock_waits(samples, stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(orders)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await sampler
+
+    latencies.sort()
+    return {
+        "orders/s": round(orders / elapsed, 1),
+        "p50 ms": round(latencies[len(latencies) // 2] * 1000, 1),
+        "p99 ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+        "rejected": rejected,
+        "avg lock waiters": round(statistics.mean(samples), 1) if samples else 0,
+        "max lock waiters": max(samples, default=0),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--shards", type=int, default=16)
+    args = parser.parse_args()
+
+    single_id = await _create_event(args.orders)
+    sharded_id = await _create_event(args.orders)
+    await set_seat_shards(sharded_id, args.shards)
+    try:
+        for label, event_id in (("single-row", single_id), (f"sharded x{args.shards}", sharded_id)):
+            result = await _run(event_id, args.orders, args.concurrency)
+            print(f"{label:>14}: " + ", ".join(f"{k}={v}" for k, v in result.items()))
+    finally:
+        async with new_session() as session:
+            await session.execute(delete(Order).where(Order.event_id.in_([single_id, sharded_id])))
+            await session.execute(delete(Event).where(Event.event_id.in_([single_id, sharded_id])))
+            await session.commit()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+"""Benchmark: JSON serialization cost of an events page, per 1000 events.
+
+Usage:
+    cd back
+    python scripts/bench_serialization.py --events 1000 --rounds 200
+
+Builds a page of event dicts shaped like service.list_events_page output and
+serves it from throwaway FastAPI apps that differ only in how the response is
+serialized:
+
+    dict + JSONResponse       the old path: jsonable_encoder + json.dumps
+    dict + ORJSONResponse     jsonable_encoder + orjson.dumps
+    model + ORJSONResponse    response_model validation + orjson.dumps
+    model + dump_json         response_model, FastAPI serializes via Pydantic
+
+Requests go through the full ASGI stack in-process (no sockets), so the
+numbers include routing but not network or database time. The ORJSONResponse
+variants are skipped when orjson is not installed.
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import warnings
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from datatypes import EventsPageOut
+
+# В свежих FastAPI ORJSONResponse помечен устаревшим; здесь он нужен для сравнения
+warnings.filterwarnings("ignore", message="ORJSONResponse is deprecated")
+
+
+def _events(count: int) -> dict:
+    start = datetime(2026, 1, 1, 19, 0)
+    return {
+        "items": [
+            {
+                "event_id": i,
+                "slug": f"ev{i:06d}",
+                "long_url": f"https://example.com/events/{i}",
+                "name": f"Концерт №{i}",
+                "place": "Большой зал",
+                "city": "Москва",
+                "event_time": start + timedelta(hours=i),
+                "event_end_time": start + timedelta(hours=i + 2),
+                "status": "scheduled",
+                "price": 1500.0 + i % 7,
+                "description": "Описание события " * 10,
+                "event_type": "Концерты",
+                "message_link": None,
+                "purchased_count": i % 100,
+                "seats_total": 100,
+                "account_id": 1,
+            }
+            for i in range(count)
+        ],
+        "next_cursor": "WyIyMDI2LTAxLTAxVDE5OjAwOjAwIiwgMTAwMF0",
+    }
+
+
+def _app(payload: dict, response_class=None, response_model=None) -> FastAPI:
+    app = FastAPI() if response_class is None else FastAPI(default_response_class=response_class)
+
+    @app.get("/events", response_model=response_model)
+    async def events():
+        return payload
+
+    return app
+
+
+async def _measure(app: FastAPI, rounds: int) -> tuple[float, int]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        size = len((await client.get("/events")).content)
+        started = time.perf_counter()
+        for _ in range(rounds):
+            (await client.get("/events")).raise_for_status()
+        return (time.perf_counter() - started) / rounds, size
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    payload = _events(args.events)
+    variants = {"dict + JSONResponse": _app(payload)}
+    if orjson is not None:
+        variants["dict + ORJSONResponse"] = _app(payload, response_class=ORJSONResponse)
+        variants["model + ORJSONResponse"] = _app(payload, response_class=ORJSONResponse, response_model=EventsPageOut)
+    variants["model + dump_json"] = _app(payload, response_model=EventsPageOut)
+    baseline = None
+    for label, app in variants.items():
+        seconds, size = await _measure(app, args.rounds)
+        per_1000 = seconds * 1000 / args.events * 1000
+        baseline = baseline or per_1000
+        print(f"{label:>24}: {per_1000:7.2f} ms per 1000 events, {size} bytes, x{baseline / per_1000:.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
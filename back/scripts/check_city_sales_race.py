@@ -0,0 +1,119 @@
+"""Concurrency check: city sales aggregates while the event changes city.
+
+Usage:
+    cd back
+    python scripts/check_city_sales_race.py --orders 3000 --concurrency 100 --moves 2000
+
+Creates a throwaway sharded event, fires concurrent orders at it through
+crud.create_order_in_db, changes people_count of already placed orders
+through crud.update_order_in_db and at the same time keeps moving the event
+between two throwaway cities through crud.update_event_in_db. At the end
+every seat sold must be counted in city_sales under the event's final city
+and nothing may be left under the other one. Exits with status 1 on a mismatch, then
+deletes the event, its orders and the city rows.
+"""
+import os
+import sys
+import random
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete, func, select
+
+from crud import add_slug_to_db, create_order_in_db, set_seat_shards, update_event_in_db, update_order_in_db
+from database.db import engine, new_session
+from database.models import CitySales, Event, Order
+from shortener import generate_slug
+
+
+async def _city_totals(cities: tuple[str, str]) -> dict[str, tuple[int, int]]:
+    async with new_session() as session:
+        result = await session.execute(
+            select(CitySales.city, func.sum(CitySales.orders_count), func.sum(CitySales.seats_sold))
+            .where(CitySales.city.in_(cities))
+            .group_by(CitySales.city)
+        )
+        totals = {city: (int(orders), int(seats)) for city, orders, seats in result}
+    return {city: totals.get(city, (0, 0)) for city in cities}
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--moves", type=int, default=2000)
+    parser.add_argument("--shards", type=int, default=8)
+    args = parser.parse_args()
+
+    suffix = generate_slug()
+    cities = (f"Race A {suffix}", f"Race B {suffix}")
+    event_id = await add_slug_to_db(
+        slug=generate_slug(),
+        long_url="https://example.invalid/race",
+        name="City sales race",
+        place="Race",
+        city=cities[0],
+        event_time=datetime.utcnow() + timedelta(days=30),
+        event_end_time=None,
+        status=None,
+        price=10,
+        description="Throwaway event created by check_city_sales_race.py",
+        purchased_count=0,
+        seats_total=args.orders,
+        account_id=0,
+    )
+    await set_seat_shards(event_id, args.shards)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    order_ids: list[int] = []
+
+    async def order():
+        async with semaphore:
+            order_id, _ = await create_order_in_db(event_id, "race", "race", 1, "race@example.invalid")
+            order_ids.append(order_id)
+
+    async def edit():
+        # Правка заказа идёт мимо блокировок create_order_in_db: со сменой
+        # города её сериализует только строка event_sales в триггерах
+        while len(order_ids) < args.orders:
+            if not order_ids:
+                await asyncio.sleep(0.01)
+                continue
+            await update_order_in_db(random.choice(order_ids), people_count=random.choice((1, 2)))
+
+    async def move():
+        for i in range(args.moves):
+            await update_event_in_db(event_id, city=cities[(i + 1) % 2])
+            await asyncio.sleep(0)
+
+    try:
+        await asyncio.gather(move(), *(edit() for _ in range(4)), *(order() for _ in range(args.orders)))
+        final_city = cities[args.moves % 2]
+        other_city = cities[(args.moves + 1) % 2]
+        async with new_session() as session:
+            orders, seats = (
+                await session.execute(
+                    select(func.count(), func.coalesce(func.sum(Order.people_count), 0)).where(
+                        Order.event_id == event_id
+                    )
+                )
+            ).one()
+        totals = await _city_totals(cities)
+        print(f"orders={orders} seats={seats} city_sales={totals}")
+        ok = totals[final_city] == (orders, seats) and totals[other_city] == (0, 0)
+        print("OK" if ok else "MISMATCH: city_sales lost or misplaced orders")
+    finally:
+        async with new_session() as session:
+            await session.execute(delete(Order).where(Order.event_id == event_id))
+            await session.execute(delete(Event).where(Event.event_id == event_id))
+            await session.execute(delete(CitySales).where(CitySales.city.in_(cities)))
+            await session.commit()
+        await engine.dispose()
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
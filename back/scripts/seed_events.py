@@ -1,4 +1,5 @@
 import requests
+import json
 from test_data import events_data
 import os
 from datetime import datetime, timedelta
@@ -29,24 +30,28 @@ def event_exists(event_data, existing_events):
             return True
     return False
 
-def add_event(event_data):
-    url = f"{API_URL}/add_event"
+def import_events(events):
+    # Все события уходят одним запросом в /events/bulk в формате JSON Lines
+    url = f"{API_URL}/events/bulk"
     headers = {
-        "Content-Type": "application/json"
+        "Content-Type": "application/x-ndjson",
+        "X-API-KEY": os.getenv("ADMIN_API_KEY", ""),
     }
-    
+    body = "\n".join(json.dumps(event, ensure_ascii=False) for event in events).encode("utf-8")
+
     try:
-        response = requests.post(url, json=event_data, headers=headers, timeout=10)
+        response = requests.post(url, data=body, headers=headers, timeout=300)
         if response.status_code == 200:
             result = response.json()
-            print(f"Событие '{event_data['name']}' успешно добавлено. Slug: {result.get('slug')}, ID: {result.get('event_id')}")
-            return True
+            for error in result.get("errors", []):
+                print(f"Ошибка в строке {error['line']}: {error['error']}")
+            return result.get("inserted", 0)
         else:
-            print(f"Ошибка при добавлении '{event_data['name']}': {response.status_code} - {response.text}")
-            return False
+            print(f"Ошибка импорта: {response.status_code} - {response.text}")
+            return 0
     except Exception as e:
-        print(f"Исключение при добавлении '{event_data['name']}': {str(e)}")
-        return False
+        print(f"Исключение при импорте: {str(e)}")
+        return 0
 
 def start_test_data_migration():
     print("Начинаю добавление событий из test_data.py в базу данных...\n")
@@ -54,19 +59,17 @@ def start_test_data_migration():
     existing_events = get_existing_events()
     print(f"Найдено существующих событий: {len(existing_events)}\n")
     
-    added_count = 0
+    new_events = []
     skipped_count = 0
     
     for event in events_data:
-        try:
-            if event_exists(event, existing_events):
-                print(f"Событие '{event['name']}' уже существует, пропускаю...")
-                skipped_count += 1
-            else:
-                if add_event(event):
-                    added_count += 1
-        except Exception as e:
-            print(f"Ошибка при обработке события '{event.get('name', 'Unknown')}': {e}")
+        if event_exists(event, existing_events):
+            print(f"Событие '{event['name']}' уже существует, пропускаю...")
+            skipped_count += 1
+        else:
+            new_events.append(event)
+
+    added_count = import_events(new_events) if new_events else 0
     
     print(f"\nГотово! Добавлено новых событий: {added_count}, пропущено существующих: {skipped_count}")
 
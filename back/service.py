@@ -1,16 +1,30 @@
 import os
+import io
+import csv
+import json
+import base64
 import smtplib
 import asyncio
+import logging
+from collections import deque
 from email.message import EmailMessage
 from urllib.parse import quote_plus
 from datetime import datetime, timezone
+from decimal import Decimal
+from typing import AsyncIterator
+from pydantic import ValidationError
 from shortener import generate_slug
+from datatypes import EventCreate
 from crud import (
     add_slug_to_db,
     create_order_in_db,
     get_all_users_from_db,
     get_all_user_emails_from_db,
     get_all_orders_from_db,
+    get_users_page_from_db,
+    get_orders_page_from_db,
+    USER_SORT_KEYS,
+    ORDER_SORT_KEYS,
     get_event_by_id,
     get_url_from_db,
     get_event_from_db,
@@ -20,8 +34,21 @@ from crud import (
     update_event_in_db,
     get_order_emails_by_event,
     get_events_between_dates,
+    get_events_by_ids,
+    search_events,
+    EVENT_FIELDS,
+    EVENT_CARD_FIELDS,
+    set_seat_shards,
+    rebalance_seat_shards,
+    get_seat_shards,
+    get_sharded_event_ids,
+    get_seat_shard_count,
+    get_existing_slugs,
+    copy_events_to_db,
+    get_event_sales_from_db,
+    get_city_sales_from_db,
 )
-from exceptions import NoUrlFoundException, SlugAlreadyExists
+from exceptions import NoUrlFoundException, SlugAlreadyExists, InvalidCursor, InvalidFields
 from mail_services import (
     send_ticket_email,
     notify_organizer_confirm,
@@ -29,8 +56,18 @@ from mail_services import (
     notify_event_updated,
     notify_event_created,
     notify_event_before_start,
+    notify_events_imported,
     admin_emails,
 )
+from recommender import recommender
+
+logger = logging.getLogger(__name__)
+
+SEAT_SHARD_REBALANCE_SECONDS = float(os.getenv("SEAT_SHARD_REBALANCE_SECONDS", "30"))
+BULK_IMPORT_BATCH_SIZE = int(os.getenv("BULK_IMPORT_BATCH_SIZE", "5000"))
+BULK_IMPORT_MAX_ERRORS = 100
+
+_seat_rebalancer: asyncio.Task | None = None
 
 async def add_event(
     long_url: str,
@@ -88,6 +125,206 @@ async def add_event(
     return None
 
 
+def _decode_line(raw: bytes, first: bool) -> str | UnicodeDecodeError:
+    try:
+        return raw.decode("utf-8-sig" if first else "utf-8")
+    except UnicodeDecodeError as exc:
+        return exc
+
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str | UnicodeDecodeError]:
+    # Каждая строка декодируется отдельно: битый UTF-8 портит только свою
+    # строку и приходит как исключение, а не обрывает весь импорт
+    tail = b""
+    first = True
+    async for chunk in chunks:
+        tail += chunk
+        *lines, tail = tail.split(b"\n")
+        for line in lines:
+            yield _decode_line(line + b"\n", first)
+            first = False
+    if tail:
+        yield _decode_line(tail, first)
+
+
+async def _iter_jsonl_rows(
+    lines: AsyncIterator[str | UnicodeDecodeError],
+) -> AsyncIterator[tuple[int, dict | Exception]]:
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        if isinstance(line, Exception):
+            yield line_no, line
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except ValueError as exc:
+            yield line_no, exc
+
+
+class _NeedMoreLines(Exception):
+    pass
+
+
+class _LineFeed:
+    """Источник строк для csv.reader, который пополняется асинхронно.
+
+    Если строк не хватило посреди записи, reader получает _NeedMoreLines;
+    уже отданные строки этой записи возвращаются в очередь и разбираются
+    заново, когда придут следующие.
+    """
+
+    def __init__(self):
+        self.pending: deque[str] = deque()
+        self.taken: list[str] = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.pending:
+            raise _NeedMoreLines
+        line = self.pending.popleft()
+        self.taken.append(line)
+        return line
+
+    def rewind(self):
+        self.pending.extendleft(reversed(self.taken))
+        self.taken.clear()
+
+
+async def _iter_csv_rows(
+    lines: AsyncIterator[str | UnicodeDecodeError],
+) -> AsyncIterator[tuple[int, dict | Exception]]:
+    # Один csv.reader на весь поток: поля в кавычках с переводами строк он
+    # разбирает сам, без подсчёта кавычек
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    source = aiter(lines)
+    header = None
+    line_no = 0
+    exhausted = False
+    while True:
+        record_line = line_no + 1
+        try:
+            values = next(reader)
+        except _NeedMoreLines:
+            feed.rewind()
+            if exhausted:
+                if feed.pending:
+                    # Поток кончился посреди записи (незакрытая кавычка)
+                    yield record_line, ValueError("Unterminated quoted field at end of input")
+                return
+            line = await anext(source, None)
+            if line is None:
+                exhausted = True
+            elif isinstance(line, Exception):
+                # Битая строка: вместе с ней отбрасываем начатую запись
+                line_no += len(feed.pending) + 1
+                feed.pending.clear()
+                yield line_no, line
+            else:
+                feed.pending.append(line)
+            continue
+        except csv.Error as exc:
+            line_no += len(feed.taken)
+            feed.taken.clear()
+            yield record_line, exc
+            continue
+        line_no += len(feed.taken)
+        feed.taken.clear()
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        # Пустая ячейка CSV означает отсутствие значения
+        yield record_line, {name: value for name, value in zip(header, values) if value != ""}
+
+
+def _event_record(slug: str, event: EventCreate) -> tuple:
+    event_time = event.event_time
+    if event_time.tzinfo is not None:
+        event_time = event_time.astimezone(timezone.utc).replace(tzinfo=None)
+    event_end_time = event.event_end_time
+    if event_end_time is not None and event_end_time.tzinfo is not None:
+        event_end_time = event_end_time.astimezone(timezone.utc).replace(tzinfo=None)
+    return (
+        slug,
+        event.long_url,
+        event.name,
+        event.place,
+        event.city,
+        event_time,
+        event_end_time,
+        event.status or "scheduled",
+        Decimal(str(event.price)),
+        event.description,
+        event.event_type,
+        event.message_link,
+        event.purchased_count,
+        event.seats_total,
+        event.account_id,
+    )
+
+
+async def _unique_slugs(count: int) -> list[str]:
+    slugs: set[str] = set()
+    while len(slugs) < count:
+        candidates = {generate_slug() for _ in range(count - len(slugs))} - slugs
+        slugs |= candidates - await get_existing_slugs(list(candidates))
+    return list(slugs)
+
+
+async def _copy_events(events: list[EventCreate]) -> int:
+    # Slug проверяются заранее одним запросом на пачку; гонка с параллельной
+    # вставкой откатывает COPY целиком, и пачка идёт заново с новыми slug
+    for _ in range(5):
+        slugs = await _unique_slugs(len(events))
+        try:
+            return await copy_events_to_db([_event_record(slug, event) for slug, event in zip(slugs, events)])
+        except SlugAlreadyExists:
+            continue
+    raise SlugAlreadyExists
+
+
+async def import_events(chunks: AsyncIterator[bytes], fmt: str) -> dict:
+    rows = _iter_csv_rows(_iter_lines(chunks)) if fmt == "csv" else _iter_jsonl_rows(_iter_lines(chunks))
+    inserted = 0
+    failed = 0
+    errors = []
+    batch: list[EventCreate] = []
+    async for line_no, row in rows:
+        try:
+            if isinstance(row, Exception):
+                raise row
+            # COPY отверг бы всю пачку: NUL не бывает в тексте Postgres
+            if isinstance(row, dict) and any(isinstance(value, str) and "\x00" in value for value in row.values()):
+                raise ValueError("NUL character is not allowed")
+            batch.append(EventCreate.model_validate(row))
+        except ValidationError as exc:
+            failed += 1
+            if len(errors) < BULK_IMPORT_MAX_ERRORS:
+                errors.append({"line": line_no, "error": exc.errors(include_url=False, include_input=False)})
+            continue
+        except (ValueError, csv.Error) as exc:
+            failed += 1
+            if len(errors) < BULK_IMPORT_MAX_ERRORS:
+                errors.append({"line": line_no, "error": str(exc)})
+            continue
+        if len(batch) >= BULK_IMPORT_BATCH_SIZE:
+            inserted += await _copy_events(batch)
+            batch = []
+    if batch:
+        inserted += await _copy_events(batch)
+
+    if inserted:
+        await notify_events_imported(admin_emails(), inserted=inserted, failed=failed)
+    return {"inserted": inserted, "failed": failed, "errors": errors}
+
+
 async def get_event_by_slug(
     slug: str
 ):
@@ -113,13 +350,14 @@ async def create_order(
     if not event:
         raise NoUrlFoundException
     qr_link = _generate_qr_link(event.long_url)
-    order_id = await create_order_in_db(
+    order_id, purchased_count = await create_order_in_db(
         event_id=event_id,
         qrcode=qr_link,
         payment_method=payment_method,
         people_count=people_count,
         email=email,
     )
+    recommender.record_order(order_id=order_id, event_id=event_id, email=email, people_count=people_count)
     await send_ticket_email(email=email, event=event, order_id=order_id, qr_link=qr_link)
     for org_email in admin_emails():
         await notify_organizer_confirm(event=event, organizer_email=org_email, participant_email=email)
@@ -135,7 +373,7 @@ async def create_order(
             "event_time": event.event_time,
             "price": float(event.price),
             "description": event.description,
-            "purchased_count": event.purchased_count,
+            "purchased_count": purchased_count,
             "seats_total": event.seats_total,
             "account_id": event.account_id,
         },
@@ -145,7 +383,67 @@ async def create_order(
     }
 
 
-async def list_events_between_dates(start: datetime, end: datetime, limit: int = 100):
+def _encode_cursor(*values) -> str:
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, *types: type) -> tuple:
+    # Типы восстанавливают значения после JSON; любой сбой — InvalidCursor
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError
+        return tuple(
+            datetime.fromisoformat(value) if kind is datetime else kind(value) for kind, value in zip(types, values)
+        )
+    except Exception:
+        raise InvalidCursor
+
+
+def parse_event_fields(fields: str | None) -> tuple[str, ...] | None:
+    """Разбирает параметр fields: None — все поля, "card" — карточка, иначе список через запятую."""
+    if fields is None:
+        return None
+    if fields == "card":
+        return EVENT_CARD_FIELDS
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    if not names or any(name not in EVENT_FIELDS for name in names):
+        raise InvalidFields
+    return names
+
+
+def _project(event: dict, fields: tuple[str, ...] | None, *required: str) -> dict:
+    if fields is None:
+        return event
+    return {name: event[name] for name in dict.fromkeys(("event_id", *required, *fields))}
+
+
+def _shared_range(start: datetime, end: datetime) -> bool:
+    # Клиенты считают дни от своей полуночи, а смещения часовых поясов
+    # кратны 15 минутам: такая граница в UTC совпадает у всех клиентов пояса
+    def aligned(moment: datetime) -> bool:
+        return moment.minute % 15 == 0 and moment.second == 0 and moment.microsecond == 0
+
+    open_start = start.replace(tzinfo=None) == datetime.min
+    open_end = end.replace(tzinfo=None) == datetime.max
+    return (open_start or aligned(start)) and (open_end or aligned(end))
+
+
+async def list_events_page(
+    start: datetime,
+    end: datetime,
+    limit: int = 100,
+    cursor: str | None = None,
+    city: str | None = None,
+    event_types: list[str] | None = None,
+    status: str | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    account_id: int | None = None,
+    fields: tuple[str, ...] | None = None,
+):
     if not start:
         start = start or datetime.min.replace(tzinfo=timezone.utc)
 
@@ -153,28 +451,75 @@ async def list_events_between_dates(start: datetime, end: datetime, limit: int =
     if not end:
         end = end or datetime.max.replace(tzinfo=timezone.utc)
 
-    events = await get_events_between_dates(start=start, end=end, limit=limit)
-    return [
-        {
-            "event_id": event.event_id,
-            "slug": event.slug,
-            "long_url": event.long_url,
-            "name": event.name,
-            "place": event.place,
-            "city": event.city,
-            "event_time": event.event_time,
-            "event_end_time": getattr(event, "event_end_time", None),
-            "status": getattr(event, "status", None),
-            "price": float(event.price),
-            "description": event.description,
-            "event_type": getattr(event, "event_type", None),
-            "message_link": getattr(event, "message_link", None),
-            "purchased_count": event.purchased_count,
-            "seats_total": event.seats_total,
-            "account_id": event.account_id,
-        }
-        for event in events
-    ]
+    after = _decode_cursor(cursor, datetime, int) if cursor else None
+    # Кэш помогает только общим для клиентов диапазонам; ключ по произвольной
+    # метке времени (например, «сейчас» с миллисекундами) никто не повторит,
+    # и такие записи лишь вытесняли бы полезные
+    load = get_events_between_dates if _shared_range(start, end) else get_events_between_dates.uncached
+    events = await load(
+        start=start,
+        end=end,
+        limit=limit + 1,
+        after=after,
+        city=city,
+        event_types=event_types,
+        status=status,
+        min_price=min_price,
+        max_price=max_price,
+        account_id=account_id,
+        fields=fields,
+    )
+    page = events[:limit]
+    next_cursor = None
+    if len(events) > limit and page:
+        next_cursor = _encode_cursor(page[-1]["event_time"], page[-1]["event_id"])
+    return {
+        "items": page,
+        "next_cursor": next_cursor,
+    }
+
+
+async def list_events_between_dates(
+    start: datetime,
+    end: datetime,
+    limit: int = 100,
+    cursor: str | None = None,
+    city: str | None = None,
+    event_types: list[str] | None = None,
+    status: str | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
+    account_id: int | None = None,
+    fields: tuple[str, ...] | None = None,
+):
+    page = await list_events_page(
+        start=start,
+        end=end,
+        limit=limit,
+        cursor=cursor,
+        city=city,
+        event_types=event_types,
+        status=status,
+        min_price=min_price,
+        max_price=max_price,
+        account_id=account_id,
+        fields=fields,
+    )
+    return page["items"]
+
+
+async def search_events_by_text(
+    query: str,
+    limit: int = 20,
+    offset: int = 0,
+    fields: tuple[str, ...] | None = None,
+):
+    # Берём на одну строку больше, чтобы понять, есть ли следующая страница
+    found = await search_events(query=query, limit=limit + 1, offset=offset, fields=fields)
+    return {
+        "items": found[:limit],
+        "next_offset": offset + limit if len(found) > limit else None,
+    }
 
 
 async def get_all_users():
@@ -185,6 +530,113 @@ async def get_all_orders():
     return await get_all_orders_from_db()
 
 
+def _decode_keyset(cursor: str, sort: str, descending: bool, columns) -> tuple:
+    # Курсор привязан к сортировке: с другой сортировкой он бессмыслен
+    cursor_sort, cursor_descending, *values = _decode_cursor(
+        cursor, str, bool, *(column.type.python_type for column in columns)
+    )
+    if cursor_sort != sort or cursor_descending != descending:
+        raise InvalidCursor
+    return tuple(values)
+
+
+async def list_users_page(
+    limit: int = 50,
+    cursor: str | None = None,
+    sort: str = "created_at",
+    descending: bool = True,
+    with_total: bool = True,
+    role: str | None = None,
+    status: str | None = None,
+    email_prefix: str | None = None,
+    name: str | None = None,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+):
+    columns = USER_SORT_KEYS[sort]
+    after = _decode_keyset(cursor, sort, descending, columns) if cursor else None
+    users, total, total_exact = await get_users_page_from_db(
+        sort=sort,
+        descending=descending,
+        after=after,
+        limit=limit + 1,
+        with_total=with_total,
+        role=role,
+        status=status,
+        email_prefix=email_prefix,
+        name=name,
+        created_from=created_from,
+        created_to=created_to,
+    )
+    page = users[:limit]
+    next_cursor = None
+    if len(users) > limit and page:
+        next_cursor = _encode_cursor(sort, descending, *(getattr(page[-1], c.key) for c in columns))
+    return {
+        "items": [
+            {
+                "id": u.id,
+                "email": u.email,
+                "display_name": u.display_name,
+                "phone": u.phone,
+                "role": u.role,
+                "status": u.status,
+                "created_at": u.created_at,
+            }
+            for u in page
+        ],
+        "next_cursor": next_cursor,
+        "total": total,
+        "total_exact": total_exact,
+    }
+
+
+async def list_orders_page(
+    limit: int = 50,
+    cursor: str | None = None,
+    sort: str = "id",
+    descending: bool = True,
+    with_total: bool = True,
+    event_id: int | None = None,
+    payment_method: str | None = None,
+    email_prefix: str | None = None,
+):
+    columns = ORDER_SORT_KEYS[sort]
+    after = _decode_keyset(cursor, sort, descending, columns) if cursor else None
+    orders, total, total_exact = await get_orders_page_from_db(
+        sort=sort,
+        descending=descending,
+        after=after,
+        limit=limit + 1,
+        with_total=with_total,
+        event_id=event_id,
+        payment_method=payment_method,
+        email_prefix=email_prefix,
+    )
+    page = orders[:limit]
+    next_cursor = None
+    if len(orders) > limit and page:
+        next_cursor = _encode_cursor(sort, descending, *(getattr(page[-1], c.key) for c in columns))
+    return {
+        "items": [
+            {
+                "id": o.id,
+                "event_id": o.event_id,
+                "qrcode": o.qrcode,
+                "payment_method": o.payment_method,
+                "people_count": o.people_count,
+                "email": o.email,
+                "created_at": o.created_at,
+                "unit_price": float(o.unit_price) if o.unit_price is not None else None,
+            }
+            for o in page
+        ],
+        "next_cursor": next_cursor,
+        "total": total,
+        "total_exact": total_exact,
+    }
+
+
 async def send_event_reminder(event_id: int):
     event = await get_event_by_id(event_id)
     if not event:
@@ -205,11 +657,21 @@ async def send_event_created_broadcast(event_id: int):
     return {"success": True, "recipients": len(recipients)}
 
 
-async def get_event_details_by_id(event_id: int) -> dict:
+async def get_event_details_by_id(event_id: int, fields: tuple[str, ...] | None = None) -> dict:
     event = await get_event_from_db(event_id)
     if not event:
         raise NoUrlFoundException
-    return event
+    return _project(event, fields)
+
+
+async def get_events_details_by_ids(event_ids: list[int], fields: tuple[str, ...] | None = None) -> dict:
+    requested = list(dict.fromkeys(event_ids))
+    events = await get_events_by_ids(requested, fields=fields)
+    by_id = {event["event_id"]: event for event in events}
+    return {
+        "items": [by_id[event_id] for event_id in requested if event_id in by_id],
+        "missing": [event_id for event_id in requested if event_id not in by_id],
+    }
 
 
 async def update_user(
@@ -317,6 +779,8 @@ async def update_event(
     )
     if not event:
         raise NoUrlFoundException
+    if seats_total is not None and await get_seat_shard_count(event_id):
+        await rebalance_seat_shards(event_id)
 
     participant_emails = await get_order_emails_by_event(event_id)
     if participant_emails:
@@ -340,6 +804,64 @@ async def update_event(
         "seats_total": event.seats_total,
         "account_id": event.account_id,
     }
+
+
+async def configure_seat_shards(event_id: int, shards: int):
+    event = await set_seat_shards(event_id, shards)
+    if not event:
+        raise NoUrlFoundException
+    return await get_event_inventory(event_id)
+
+
+async def get_event_inventory(event_id: int):
+    event = await get_event_from_db(event_id)
+    if not event:
+        raise NoUrlFoundException
+    shards = await get_seat_shards(event_id)
+    return {
+        "event_id": event_id,
+        "seats_total": event["seats_total"],
+        "purchased_count": event["purchased_count"],
+        "sharded": bool(shards),
+        "shards": [
+            {"shard_no": shard.shard_no, "capacity": shard.capacity, "sold": shard.sold}
+            for shard in shards
+        ],
+    }
+
+
+async def get_event_sales(event_id: int) -> dict:
+    if not await get_event_from_db(event_id):
+        raise NoUrlFoundException
+    return {"event_id": event_id, **await get_event_sales_from_db(event_id)}
+
+
+async def get_city_sales() -> dict:
+    return {"items": await get_city_sales_from_db()}
+
+
+async def _rebalance_seat_shards_forever():
+    while True:
+        await asyncio.sleep(SEAT_SHARD_REBALANCE_SECONDS)
+        try:
+            for event_id in await get_sharded_event_ids():
+                await rebalance_seat_shards(event_id)
+        except Exception:
+            logger.exception("Seat shard rebalancing failed")
+
+
+def start_seat_rebalancer():
+    global _seat_rebalancer
+    _seat_rebalancer = asyncio.create_task(_rebalance_seat_shards_forever())
+
+
+async def stop_seat_rebalancer():
+    global _seat_rebalancer
+    if _seat_rebalancer is not None:
+        _seat_rebalancer.cancel()
+        await asyncio.gather(_seat_rebalancer, return_exceptions=True)
+        _seat_rebalancer = None
+
     
 def get_preview():
     return {"data": [
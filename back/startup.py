@@ -0,0 +1,53 @@
+"""Замер времени старта приложения по фазам.
+
+main.py отмечает начало импорта первой строкой, lifespan оборачивает каждый
+шаг в phase(). После старта отчёт пишется в лог и доступен на
+/metrics/startup. Если старт дольше STARTUP_BUDGET_SECONDS — warning: новые
+поды при автомасштабировании должны подниматься быстро.
+
+Подробная разбивка импортов по модулям:
+    python -X importtime -c "import main" 2> importtime.log
+"""
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "5"))
+
+
+class StartupReport:
+    def __init__(self, started: float):
+        self.started = started
+        self.phases: dict[str, float] = {}
+        self.ready_seconds: float | None = None
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def finish(self):
+        self.ready_seconds = time.perf_counter() - self.started
+        breakdown = ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.phases.items())
+        if self.ready_seconds > STARTUP_BUDGET_SECONDS:
+            logger.warning(
+                "Startup took %.2fs, over the %.2fs budget (%s)", self.ready_seconds, STARTUP_BUDGET_SECONDS, breakdown
+            )
+        else:
+            logger.info("Startup took %.2fs (%s)", self.ready_seconds, breakdown)
+
+    def as_dict(self) -> dict:
+        return {
+            "ready_ms": self.ready_seconds * 1000 if self.ready_seconds is not None else None,
+            "budget_ms": STARTUP_BUDGET_SECONDS * 1000,
+            "phases_ms": {name: seconds * 1000 for name, seconds in self.phases.items()},
+        }
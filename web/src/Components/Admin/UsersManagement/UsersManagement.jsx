@@ -1,13 +1,17 @@
 // web/src/Components/Admin/UsersManagement/UsersManagement.jsx
-import { useState, useEffect, useMemo } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import './UsersManagement.scss';
-import { getAllUsers, updateUserByAdmin, deleteUserByAdmin } from '../../../services/adminService';
+import { getUsersPage, updateUserByAdmin, deleteUserByAdmin } from '../../../services/adminService';
 import UserEditModal from '../UserEditModal/UserEditModal';
 import UserFilters from '../UserFilters/UserFilters';
 
 function UsersManagement() {
   const [users, setUsers] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [total, setTotal] = useState(null);
+  const [totalExact, setTotalExact] = useState(true);
   const [selectedUser, setSelectedUser] = useState(null);
   const [showEditModal, setShowEditModal] = useState(false);
   const [filters, setFilters] = useState({
@@ -24,50 +28,51 @@ function UsersManagement() {
     setTimeout(() => setToast(null), 3000);
   };
 
+  // Номер последнего запроса: ответы на устаревшие фильтры отбрасываем
+  const requestId = useRef(0);
+
   useEffect(() => {
-    loadUsers();
-  }, []);
+    // Ввод имени не должен отправлять запрос на каждое нажатие
+    const timer = setTimeout(() => loadUsers(), 300);
+    return () => clearTimeout(timer);
+  }, [filters]);
 
   const loadUsers = async () => {
+    const current = ++requestId.current;
     try {
       setLoading(true);
-      const data = await getAllUsers();
-      setUsers(data);
+      const data = await getUsersPage(filters);
+      if (current !== requestId.current) return;
+      setUsers(data.items);
+      setNextCursor(data.next_cursor);
+      setTotal(data.total);
+      setTotalExact(data.total_exact);
     } catch (error) {
       showToast('Ошибка загрузки пользователей', 'error');
       console.error(error);
     } finally {
-      setLoading(false);
+      if (current === requestId.current) {
+        setLoading(false);
+      }
     }
   };
 
-  const filteredUsers = useMemo(() => {
-    return users.filter(user => {
-      if (filters.name && !user.display_name?.toLowerCase().includes(filters.name.toLowerCase())) {
-        return false;
-      }
-
-      if (filters.role && user.role !== filters.role) {
-        return false;
-      }
-
-      if (filters.status && user.status !== filters.status) {
-        return false;
-      }
-
-      if (filters.dateFrom || filters.dateTo) {
-        const createdDate = new Date(user.created_at);
-        if (filters.dateFrom && createdDate < new Date(filters.dateFrom)) {
-          return false;
-        }
-        if (filters.dateTo && createdDate > new Date(filters.dateTo)) {
-          return false;
-        }
-      }
-
-      return true;
-    });
-  }, [users, filters]);
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    const current = requestId.current;
+    try {
+      setLoadingMore(true);
+      const data = await getUsersPage(filters, nextCursor);
+      if (current !== requestId.current) return;
+      setUsers(prev => [...prev, ...data.items]);
+      setNextCursor(data.next_cursor);
+    } catch (error) {
+      showToast('Ошибка загрузки пользователей', 'error');
+      console.error(error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   const handleEdit = (user) => {
     setSelectedUser(user);
@@ -100,16 +105,17 @@ function UsersManagement() {
     }
   };
 
-  if (loading) {
-    return <div className="users-loading">Загрузка...</div>;
-  }
-
   return (
     <div className="users-management">
       {toast && <div className={`toast toast-${toast.type}`}>{toast.message}</div>}
       
       <UserFilters filters={filters} onFiltersChange={setFilters} />
 
+      {loading && <div className="users-loading">Загрузка...</div>}
+      {!loading && total !== null && (
+        <div className="users-total">Найдено: {totalExact ? '' : '≈ '}{total.toLocaleString('ru-RU')}</div>
+      )}
+
       <div className="users-table-wrapper">
         <table className="users-table">
           <thead>
@@ -123,7 +129,7 @@ function UsersManagement() {
             </tr>
           </thead>
           <tbody>
-            {filteredUsers.map(user => (
+            {users.map(user => (
               <tr key={user.id} className={`user-row ${user.status === 'deleted' ? 'deleted' : ''}`}>
                 <td>{user.display_name || 'N/A'}</td>
                 <td>{user.email}</td>
@@ -155,11 +161,17 @@ function UsersManagement() {
           </tbody>
         </table>
 
-        {filteredUsers.length === 0 && (
+        {!loading && users.length === 0 && (
           <div className="empty-state">
             <p>Пользователи не найдены</p>
           </div>
         )}
+
+        {nextCursor && (
+          <button type="button" className="load-more-btn" onClick={loadMore} disabled={loadingMore}>
+            {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+          </button>
+        )}
       </div>
 
       {showEditModal && (
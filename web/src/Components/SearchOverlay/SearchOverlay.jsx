@@ -1,54 +1,54 @@
-import { useEffect, useMemo, useRef, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import './SearchOverlay.scss';
-import { getApiUrl } from '../../config/api';
+import { getAfishaEvents, searchEvents } from '../../services/eventService';
 
 const MAX_RESULTS = 8;
+const SEARCH_DELAY_MS = 250;
 
 function SearchOverlay({ isOpen, onClose, onNavigate }) {
   const [query, setQuery] = useState('');
-  const [catalog, setCatalog] = useState([]);
+  const [items, setItems] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
   const inputRef = useRef(null);
 
   useEffect(() => {
-    if (!isOpen) return;
-    setQuery('');
+    if (isOpen) setQuery('');
+  }, [isOpen]);
+
+  // Ищет сервер (GET /events/search); без запроса показываем ближайшие события
+  useEffect(() => {
+    if (!isOpen) return undefined;
+    const normalizedQuery = query.trim();
+    const controller = new AbortController();
     setError('');
     setLoading(true);
 
-    fetch(getApiUrl('/events/between'), {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-        'ngrok-skip-browser-warning': 'true',
-      },
-      body: JSON.stringify({
-        start: new Date().toISOString(),
-        end: new Date(Date.now() + 365 * 24 * 60 * 60 * 1000).toISOString(),
-        limit: 1000,
-      }),
-    })
-      .then((res) => {
-        if (!res.ok) {
-          throw new Error(`HTTP error! status: ${res.status}`);
-        }
-        return res.json();
-      })
-      .then((events) => {
-        if (Array.isArray(events) && events.length > 0) {
-          setCatalog(events);
-          setError('');
-        } else {
-          setError('Не удалось загрузить каталог. Попробуйте позже.');
-        }
-      })
-      .catch((err) => {
-        console.error('Ошибка загрузки каталога для поиска:', err);
-        setError('Не удалось загрузить каталог. Попробуйте позже.');
-      })
-      .finally(() => setLoading(false));
-  }, [isOpen]);
+    const load = normalizedQuery
+      ? () => searchEvents(normalizedQuery, MAX_RESULTS, { signal: controller.signal }).then((data) => data.items)
+      : () => getAfishaEvents(MAX_RESULTS);
+    const timer = setTimeout(() => {
+      load()
+        .then((events) => {
+          if (controller.signal.aborted) return;
+          setItems(Array.isArray(events) ? events.slice(0, MAX_RESULTS) : []);
+        })
+        .catch((err) => {
+          if (controller.signal.aborted) return;
+          console.error('Ошибка поиска событий:', err);
+          setItems([]);
+          setError('Не удалось загрузить события. Попробуйте позже.');
+        })
+        .finally(() => {
+          if (!controller.signal.aborted) setLoading(false);
+        });
+    }, normalizedQuery ? SEARCH_DELAY_MS : 0);
+
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
+  }, [isOpen, query]);
 
   useEffect(() => {
     if (!isOpen) return undefined;
@@ -75,28 +75,6 @@ function SearchOverlay({ isOpen, onClose, onNavigate }) {
     };
   }, [isOpen, onClose]);
 
-  const filteredItems = useMemo(() => {
-    const normalizedQuery = query.trim().toLowerCase();
-    if (!normalizedQuery) {
-      return catalog.slice(0, MAX_RESULTS);
-    }
-
-    return catalog
-      .filter((item) => {
-        const name = (item.name || '').toLowerCase();
-        const description = (item.description || '').toLowerCase();
-        const place = (item.place || '').toLowerCase();
-        const city = (item.city || '').toLowerCase();
-        return (
-          name.includes(normalizedQuery) ||
-          description.includes(normalizedQuery) ||
-          place.includes(normalizedQuery) ||
-          city.includes(normalizedQuery)
-        );
-      })
-      .slice(0, MAX_RESULTS);
-  }, [catalog, query]);
-
   const handleSelectItem = (item) => {
     if (!item || typeof item.event_id === 'undefined') return;
     onClose?.();
@@ -139,16 +117,16 @@ function SearchOverlay({ isOpen, onClose, onNavigate }) {
         </div>
 
         <div className="search-overlay-content">
-          {loading && <div className="search-state">Загружаем каталог...</div>}
+          {loading && <div className="search-state">Ищем события...</div>}
           {error && !loading && <div className="search-state error">{error}</div>}
 
-          {!loading && !error && filteredItems.length === 0 && (
+          {!loading && !error && items.length === 0 && (
             <div className="search-state">Ничего не найдено. Попробуйте другой запрос.</div>
           )}
 
-          {!loading && !error && filteredItems.length > 0 && (
+          {!loading && !error && items.length > 0 && (
             <ul className="search-results">
-              {filteredItems.map((item) => (
+              {items.map((item) => (
                 <li key={`event-${item.event_id}`}>
                   <button type="button" className="search-result-card" onClick={() => handleSelectItem(item)}>
                     <div className="poster">
@@ -1,6 +1,6 @@
 import { useEffect, useMemo, useState } from 'react';
 import './MyEvents.scss';
-import { getEventById } from '../../services/eventService';
+import { getEventsByIds } from '../../services/eventService';
 import { showError } from '../../Components/Toast/Toast';
 
 const PARTICIPATION_KEY = 'event_participation';
@@ -43,12 +43,9 @@ function MyEvents({ onNavigate }) {
     const load = async () => {
       setLoading(true);
       try {
-        const results = await Promise.allSettled(ids.map((id) => getEventById(id)));
+        const { items } = await getEventsByIds(ids);
         if (cancelled) return;
-        const okEvents = results
-          .map((res) => (res.status === 'fulfilled' ? res.value : null))
-          .filter(Boolean);
-        setEvents(okEvents);
+        setEvents(items);
       } catch (e) {
         if (!cancelled) {
           showError('Не удалось загрузить список моих событий');
@@ -10,5 +10,25 @@ export const getApiUrl = (path) => {
   return `${API_BASE_URL}${cleanPath}`;
 };
 
+// После записи бэкенд отдаёт метку x-primary-until; пока она не истекла,
+// он читает из primary, а не из отстающей реплики. Клиент на другом домене
+// cookie не шлёт, поэтому метка возвращается заголовком. Срок проверяет
+// сервер, клиент просто повторяет последнюю полученную метку
+const PRIMARY_UNTIL = 'x-primary-until';
+
+export const apiFetch = async (url, options = {}) => {
+  const headers = new Headers(options.headers);
+  const primaryUntil = sessionStorage.getItem(PRIMARY_UNTIL);
+  if (primaryUntil) {
+    headers.set(PRIMARY_UNTIL, primaryUntil);
+  }
+  const response = await fetch(url, { ...options, headers });
+  const until = response.headers.get(PRIMARY_UNTIL);
+  if (until) {
+    sessionStorage.setItem(PRIMARY_UNTIL, until);
+  }
+  return response;
+};
+
 export default API_BASE_URL;
 
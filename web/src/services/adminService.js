@@ -1,5 +1,5 @@
 // web/src/services/adminService.js
-import { getApiUrl } from '../config/api';
+import { apiFetch, getApiUrl } from '../config/api';
 import { getAuthToken } from './authService';
 
 const getHeaders = () => ({
@@ -11,7 +11,7 @@ const getHeaders = () => ({
 // Users management
 export const getAllUsers = async () => {
   try {
-    const response = await fetch(getApiUrl('/users'), {
+    const response = await apiFetch(getApiUrl('/users'), {
       method: 'GET',
       headers: getHeaders(),
     });
@@ -27,9 +27,38 @@ export const getAllUsers = async () => {
   }
 };
 
+export const getUsersPage = async (filters = {}, cursor = null, limit = 50) => {
+  const params = new URLSearchParams({ limit: String(limit) });
+  if (cursor) params.set('cursor', cursor);
+  if (filters.name) params.set('name', filters.name);
+  if (filters.email) params.set('email', filters.email);
+  if (filters.role) params.set('role', filters.role);
+  if (filters.status) params.set('status', filters.status);
+  if (filters.dateFrom) params.set('created_from', `${filters.dateFrom}T00:00:00`);
+  if (filters.dateTo) params.set('created_to', `${filters.dateTo}T23:59:59`);
+  // Общее число нужно только для первой страницы
+  if (cursor) params.set('with_total', 'false');
+
+  try {
+    const response = await apiFetch(getApiUrl(`/users/page?${params.toString()}`), {
+      method: 'GET',
+      headers: getHeaders(),
+    });
+
+    if (!response.ok) {
+      throw new Error('Failed to fetch users');
+    }
+
+    return await response.json();
+  } catch (error) {
+    console.error('Error fetching users:', error);
+    throw error;
+  }
+};
+
 export const updateUserByAdmin = async (userId, userData) => {
   try {
-    const response = await fetch(getApiUrl(`/users/${userId}`), {
+    const response = await apiFetch(getApiUrl(`/users/${userId}`), {
       method: 'PATCH',
       headers: getHeaders(),
       body: JSON.stringify(userData),
@@ -48,7 +77,7 @@ export const updateUserByAdmin = async (userId, userData) => {
 
 export const deleteUserByAdmin = async (userId) => {
   try {
-    const response = await fetch(getApiUrl(`/users/${userId}`), {
+    const response = await apiFetch(getApiUrl(`/users/${userId}`), {
       method: 'DELETE',
       headers: getHeaders(),
     });
@@ -67,7 +96,7 @@ export const deleteUserByAdmin = async (userId) => {
 // Events management
 export const getAllEvents = async () => {
   try {
-    const response = await fetch(getApiUrl('/events/all'), {
+    const response = await apiFetch(getApiUrl('/events/all'), {
       method: 'GET',
       headers: getHeaders(),
     });
@@ -85,7 +114,7 @@ export const getAllEvents = async () => {
 
 export const createEvent = async (eventData) => {
   try {
-    const response = await fetch(getApiUrl('/add_event'), {
+    const response = await apiFetch(getApiUrl('/add_event'), {
       method: 'POST',
       headers: getHeaders(),
       body: JSON.stringify(eventData),
@@ -104,7 +133,7 @@ export const createEvent = async (eventData) => {
 
 export const updateEvent = async (eventId, eventData) => {
   try {
-    const response = await fetch(getApiUrl(`/events/${eventId}`), {
+    const response = await apiFetch(getApiUrl(`/events/${eventId}`), {
       method: 'PATCH',
       headers: getHeaders(),
       body: JSON.stringify(eventData),
@@ -123,7 +152,7 @@ export const updateEvent = async (eventId, eventData) => {
 
 export const getEventById = async (eventId) => {
   try {
-    const response = await fetch(getApiUrl(`/events/get/${eventId}`), {
+    const response = await apiFetch(getApiUrl(`/events/get/${eventId}`), {
       method: 'GET',
       headers: {
         'ngrok-skip-browser-warning': 'true',
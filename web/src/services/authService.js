@@ -1,4 +1,4 @@
-import { getApiUrl } from '../config/api';
+import { apiFetch, getApiUrl } from '../config/api';
 
 const AUTH_STORAGE_KEY = 'auth_user';
 const TOKEN_STORAGE_KEY = 'auth_token';
@@ -72,7 +72,7 @@ const notifyListeners = (user) => {
 
 export const loginUser = async (email, password) => {
   try {
-    const response = await fetch(getApiUrl('/auth/login'), {
+    const response = await apiFetch(getApiUrl('/auth/login'), {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -119,7 +119,7 @@ export const loginUser = async (email, password) => {
 
 export const registerUser = async (email, password, userData = {}) => {
   try {
-    const response = await fetch(getApiUrl('/auth/register'), {
+    const response = await apiFetch(getApiUrl('/auth/register'), {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -152,7 +152,7 @@ export const updateUserProfileAfterRegistration = async (userData) => {
     }
     
     if (Object.keys(updateData).length > 0) {
-      const response = await fetch(getApiUrl('/users/me'), {
+      const response = await apiFetch(getApiUrl('/users/me'), {
         method: 'PATCH',
         headers: {
           'Content-Type': 'application/json',
@@ -208,7 +208,7 @@ export const getUserProfile = async () => {
   }
   
   try {
-    const response = await fetch(getApiUrl('/users/me'), {
+    const response = await apiFetch(getApiUrl('/users/me'), {
       method: 'GET',
       headers: {
         'Authorization': `Bearer ${currentUser.idToken}`,
@@ -299,7 +299,7 @@ export const updateUserProfile = async (profileData) => {
     console.log('Final data keys:', Object.keys(sanitizedFinalData));
     console.log('Final data values:', Object.values(sanitizedFinalData));
     
-    const response = await fetch(getApiUrl('/users/me'), {
+    const response = await apiFetch(getApiUrl('/users/me'), {
       method: 'PATCH',
       headers: {
         'Content-Type': 'application/json',
@@ -378,7 +378,7 @@ export const getAuthToken = () => {
 
 export const verifyRegistrationCode = async (email, code) => {
   try {
-    const response = await fetch(getApiUrl('/auth/verify-registration-code'), {
+    const response = await apiFetch(getApiUrl('/auth/verify-registration-code'), {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -1,9 +1,9 @@
-import { getApiUrl } from '../config/api';
+import { apiFetch, getApiUrl } from '../config/api';
 
 export const getEventsBetweenDates = async (startDate, endDate, limit = 100) => {
   try {
     const url = getApiUrl(`/events/between?limit=${limit}`);
-    const response = await fetch(url, {
+    const response = await apiFetch(url, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -48,7 +48,7 @@ export const getAfishaEvents = async (limit = 10) => {
 };
 
 export const getEventById = async (eventId) => {
-  const response = await fetch(getApiUrl(`/events/get/${eventId}`), {
+  const response = await apiFetch(getApiUrl(`/events/get/${eventId}`), {
     headers: {
       'ngrok-skip-browser-warning': 'true',
     },
@@ -61,9 +61,42 @@ export const getEventById = async (eventId) => {
   return await response.json();
 };
 
+export const getEventsByIds = async (eventIds) => {
+  const response = await apiFetch(getApiUrl('/events/batch'), {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'ngrok-skip-browser-warning': 'true',
+    },
+    body: JSON.stringify({ ids: eventIds }),
+  });
+
+  if (!response.ok) {
+    throw new Error('Не удалось загрузить события');
+  }
+
+  return await response.json();
+};
+
+export const searchEvents = async (query, limit = 20, { signal } = {}) => {
+  const params = new URLSearchParams({ q: query, limit: String(limit) });
+  const response = await apiFetch(getApiUrl(`/events/search?${params.toString()}`), {
+    headers: {
+      'ngrok-skip-browser-warning': 'true',
+    },
+    signal,
+  });
+
+  if (!response.ok) {
+    throw new Error('Не удалось выполнить поиск');
+  }
+
+  return await response.json();
+};
+
 export const createEventOrder = async ({ eventId, email, peopleCount = 1, paymentMethod = 'online' }) => {
   try {
-    const response = await fetch(getApiUrl('/order'), {
+    const response = await apiFetch(getApiUrl('/order'), {
       method: 'POST',
       mode: 'cors',
       headers: {